@@ -0,0 +1,152 @@
+import hashlib
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, request
+
+import queries
+from compression import ENCODINGS, encoded_etag
+from models import Artist, Venue
+from pagination import paginate
+
+# ----------------------------------------------------------------------------#
+# JSON API.
+# ----------------------------------------------------------------------------#
+
+# The data of the HTML pages as JSON. Each response carries a strong ETag
+# computed from the id and updated_at of every row it is built from (plus
+# the past/upcoming flag of shows), so a client revalidating with
+# If-None-Match gets a 304 before anything is serialised. Compressed
+# responses carry it with the encoding appended (compression.py).
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def row_versions_etag(*versions):
+    payload = json.dumps(versions, default=str, separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def json_response(data, status=200):
+    # compact regardless of debug mode, unlike jsonify
+    return Response(json.dumps(data, separators=(',', ':'), default=str),
+                    status=status, mimetype='application/json')
+
+
+def conditional(etag, build):
+    """304 when the client already holds `etag`, in any encoding, else the
+    JSON of build()."""
+    held = [etag] + [encoded_etag(etag, encoding) for encoding in ENCODINGS]
+    for tag in held:
+        # If-None-Match compares weakly (RFC 7232); the tags sent are strong
+        if request.if_none_match.contains_weak(tag):
+            # the validator of the representation the client holds
+            response = Response(status=304)
+            response.set_etag(tag)
+            break
+    else:
+        response = json_response(build())
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def page_links(page):
+    return {'next': page.next_cursor, 'prev': page.prev_cursor,
+            'per_page': page.per_page}
+
+
+def _time(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+@api.route('/venues')
+def venues():
+    page = paginate(queries.venue_listing(), queries.VENUE_KEYSET)
+    etag = row_versions_etag(
+        [(row.id, row.updated_at) for row in page.items], page_links(page))
+    return conditional(etag, lambda: dict(page_links(page), data=[{
+        'id': row.id,
+        'name': row.name,
+        'city': row.city,
+        'state': row.state,
+        'num_upcoming_shows': row.num_upcoming_shows,
+    } for row in page.items]))
+
+
+@api.route('/artists')
+def artists():
+    page = paginate(queries.artist_listing(), queries.ARTIST_KEYSET)
+    etag = row_versions_etag(
+        [(row.id, row.updated_at) for row in page.items], page_links(page))
+    return conditional(etag, lambda: dict(page_links(page), data=[{
+        'id': row.id,
+        'name': row.name,
+    } for row in page.items]))
+
+
+@api.route('/shows')
+def shows():
+    page = paginate(queries.show_listing(), queries.SHOW_KEYSET)
+    etag = row_versions_etag(
+        [(row.id, row.updated_at, row.venue_updated_at,
+          row.artist_updated_at) for row in page.items], page_links(page))
+    return conditional(etag, lambda: dict(page_links(page), data=[{
+        'id': row.id,
+        'venue_id': row.venue_id,
+        'venue_name': row.venue_name,
+        'artist_id': row.artist_id,
+        'artist_name': row.artist_name,
+        'artist_image_link': row.artist_image_link,
+        'start_time': _time(row.start_time),
+    } for row in page.items]))
+
+
+def _detail(entity, shows, counterpart, fields):
+    versions = [(entity.id, entity.updated_at)] + [
+        (show.updated_at, getattr(show, counterpart + '_updated_at'),
+         show.upcoming) for show in shows]
+
+    def build():
+        data = {field: getattr(entity, field) for field in fields}
+        data['past_shows'], data['upcoming_shows'] = [], []
+        for show in shows:
+            (data['upcoming_shows'] if show.upcoming
+             else data['past_shows']).append({
+                counterpart + '_id': getattr(show, counterpart + '_id'),
+                counterpart + '_name': getattr(show, counterpart + '_name'),
+                counterpart + '_image_link': getattr(
+                    show, counterpart + '_image_link'),
+                'start_time': _time(show.start_time),
+            })
+        data['past_shows_count'] = len(data['past_shows'])
+        data['upcoming_shows_count'] = len(data['upcoming_shows'])
+        return data
+
+    return conditional(row_versions_etag(versions), build)
+
+
+@api.route('/venues/<int:venue_id>')
+def venue(venue_id):
+    venue = Venue.query.options(queries.WITH_DETAILS).get_or_404(venue_id)
+    shows = queries.venue_shows(venue_id, datetime.now()).all()
+    return _detail(venue, shows, 'artist', [
+        'id', 'name', 'genres', 'address', 'city', 'state', 'phone',
+        'website', 'facebook_link', 'seeking_talent', 'image_link',
+        'description'])
+
+
+@api.route('/artists/<int:artist_id>')
+def artist(artist_id):
+    artist = Artist.query.options(queries.WITH_DETAILS).get_or_404(
+        artist_id)
+    shows = queries.artist_shows(artist_id, datetime.now()).all()
+    return _detail(artist, shows, 'venue', [
+        'id', 'name', 'genres', 'city', 'state', 'phone', 'website',
+        'facebook_link', 'seeking_venue', 'image_link', 'description'])
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def error(error):
+    return json_response({'error': error.name}, error.code)
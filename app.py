@@ -3,9 +3,11 @@
 # ----------------------------------------------------------------------------#
 
 import json
+import functools
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+import babel.dates
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -15,6 +17,24 @@ from flask_wtf import Form
 from forms import *
 import sys
 from models import Artist, Venue, Show, artist_show, db
+import search
+from pagination import paginate
+import queries
+from cache import ResponseCache
+from invalidation import InvalidationBus
+import counters
+import importer
+import seed
+from export import export, export_cli
+from api import api
+from health import health
+import compression
+import instrumentation
+from instrumentation import query_budget
+import assets
+import budgets
+import freeze
+from database import read_only
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -26,6 +46,23 @@ app.config.from_object('config')
 
 db.init_app(app)
 migrate = Migrate(app, db)
+cache = ResponseCache(app)
+bus = InvalidationBus(app, cache)
+app.cli.add_command(counters.counters_cli)
+app.cli.add_command(importer.import_cli)
+app.cli.add_command(seed.seed_command)
+app.cli.add_command(budgets.budgets_cli)
+app.cli.add_command(freeze.freeze_command)
+app.cli.add_command(assets.assets_cli)
+app.cli.add_command(export_cli)
+app.cli.add_command(search.search_cli)
+app.register_blueprint(export)
+app.register_blueprint(api)
+app.register_blueprint(health)
+app.register_blueprint(assets.assets)
+compression.init_app(app)
+instrumentation.init_app(app)
+search.init_app(app)
 
 
 
@@ -34,23 +71,172 @@ migrate = Migrate(app, db)
 # ----------------------------------------------------------------------------#
 
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+    # babel.dates.format_datetime parses the pattern on every call; parse
+    # each (format, locale) once
+    return (babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)),
+            babel.Locale.parse(locale))
+
+
+def _format_datetime(value, format, locale):
+    pattern, locale = datetime_pattern(format, locale)
+    return pattern.apply(value, locale)
+
+
+if app.config['DATETIME_MEMO_SIZE']:
+    _format_datetime = functools.lru_cache(
+        maxsize=app.config['DATETIME_MEMO_SIZE'])(_format_datetime)
+
+
+def format_datetime(value, format='medium', locale='en'):
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    return _format_datetime(value, format, locale)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+# ----------------------------------------------------------------------------#
+# Helpers.
+# ----------------------------------------------------------------------------#
+
+
+def partition_shows(shows):
+    # split show rows on the `upcoming` flag computed by the query
+    past_shows, upcoming_shows = [], []
+    for show in shows:
+        (upcoming_shows if show.upcoming else past_shows).append(show)
+    return past_shows, upcoming_shows
+
+
+@app.template_global()
+def page_url(**changes):
+    # the current listing URL with its pagination arguments replaced
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update(request.view_args or {})
+    args.update(changes)
+    return url_for(request.endpoint, **args)
+
+
+def venue_areas(locations):
+    # group venue rows, sorted by state and city, into the directory areas
+    areas = []
+    for location in locations:
+        if not areas or (areas[-1]["city"], areas[-1]["state"]) != (
+                location.city, location.state):
+            areas.append({
+                "city": location.city,
+                "state": location.state,
+                "venues": []
+            })
+        areas[-1]["venues"].append(location)
+    return areas
+
+
+def _joined(chunks, size):
+    # join template chunks up to `size` characters, so a streamed page is
+    # not written to the socket a tag at a time
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    # render_template, sending the page while Jinja generates it (what
+    # Flask 2.2 calls stream_template). Buffered in debug mode: the query
+    # panel is added to the finished page, once every statement has run
+    if app.debug:
+        return render_template(template_name, **context)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(_joined(
+        template.generate(context), app.config['STREAM_CHUNK_SIZE'])))
+
+
+def search_results(rows):
+    return {"count": len(rows), "data": rows}
+
+
+def _with_shows(data, shows):
+    data["past_shows"], data["upcoming_shows"] = partition_shows(shows)
+    data["past_shows_count"] = len(data["past_shows"])
+    data["upcoming_shows_count"] = len(data["upcoming_shows"])
+    return data
+
+
+def venue_details(venue, shows):
+    # the venue page: the venue and its show rows from queries.venue_shows
+    return _with_shows({
+        "id": venue.id,
+        "name": venue.name,
+        "genres": venue.genres,
+        "address": venue.address,
+        "city": venue.city,
+        "state": venue.state,
+        "phone": venue.phone,
+        "website": venue.website,
+        "facebook_link": venue.facebook_link,
+        "seeking_talent": venue.seeking_talent,
+        "image_link": venue.image_link,
+        "description": venue.description
+    }, shows)
+
+
+def artist_details(artist, shows):
+    # the artist page: the artist and its show rows from queries.artist_shows
+    return _with_shows({
+        "id": artist.id,
+        "name": artist.name,
+        "genres": artist.genres,
+        "city": artist.city,
+        "state": artist.state,
+        "phone": artist.phone,
+        "facebook_link": artist.facebook_link,
+        "image_link": artist.image_link,
+        "website": artist.website,
+        "seeking_venue": artist.seeking_venue,
+        "description": artist.description
+    }, shows)
+
+
+def venue_pages(venue_id):
+    # cache namespaces of every page that renders the venue
+    artist_ids = db.session.query(Show.artist_id).filter(
+        Show.venue_id == venue_id).distinct()
+    return ['venues', 'shows', 'venue:%s' % venue_id] + [
+        'artist:%s' % artist_id for (artist_id,) in artist_ids]
+
+
+def artist_pages(artist_id):
+    # cache namespaces of every page that renders the artist
+    venue_ids = db.session.query(Show.venue_id).filter(
+        Show.artist_id == artist_id).distinct()
+    return ['artists', 'shows', 'artist:%s' % artist_id] + [
+        'venue:%s' % venue_id for (venue_id,) in venue_ids]
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
 
 @app.route('/')
+@query_budget(0)
 def index():
     return render_template('pages/home.html')
 
@@ -59,119 +245,65 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@query_budget(1)
+@cache.cached('venues')
 def venues():
-    data = []
-    unique_city_with_states = Venue.query.distinct(
-        Venue.city, Venue.state).all()
-
-    for location in unique_city_with_states:
-        city_state = {
-            "city": location.city,
-            "state": location.state,
-        }
-
-        venues = Venue.query.filter_by(
-            city=location.city, state=location.state).all()
-
-        location_venues = []
-        for venue in venues:
-            pending_shows = len(Show.query.filter_by(venue_id=venue.id).filter(
-                Show.start_time > datetime.now()).all())
-            location_venues.append({
-                "id": venue.id,
-                "name": venue.name,
-                "num_upcoming_shows": pending_shows
-            })
-        city_state["venues"] = location_venues
-        data.append(city_state)
+    page = paginate(queries.venue_listing(), queries.VENUE_KEYSET)
+
+    return stream_page('pages/venues.html', areas=venue_areas(page.items),
+                       page=page)
+
 
-    return render_template('pages/venues.html', areas=data)
+@app.route('/venues/genres/<genre>')
+@query_budget(1)
+@cache.cached('venues')
+def venues_by_genre(genre):
+    # e.g. /venues/genres/Jazz?city=San Francisco&state=CA
+    locations = queries.by_genre(queries.venue_listing(), Venue, genre,
+                                 request.args.get('city'),
+                                 request.args.get('state'))
+    page = paginate(locations, queries.VENUE_KEYSET)
+
+    return stream_page('pages/venues.html', areas=venue_areas(page.items),
+                       page=page)
 
 
 @app.route('/venues/search', methods=['POST'])
+@query_budget(2)
+@read_only
 def search_venues():
-    real_search = {}
     search_term = request.form.get('search_term', '')
-    real_search['search_term'] = search_term
-    venues = Venue.query.filter(Venue.name.ilike(
-        '%' + search_term + '%')).all()
-    
-    artists = Artist.query.filter(Artist.name.ilike(
-        '%' + search_term + '%')).all()
-
-    real_search['count'] = len(venues) + len(artists)
-    
-    real_search['data'] = []
-
-    for venue in venues:
-        real_search['data'].append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len(Show.query.filter_by(
-                venue_id=venue.id).filter(Show.start_time > datetime.now()).all())
-        })
-
-    for artist in artists:
-        real_search['data'].append({
-            "id": artist.id,
-            "name": artist.name,
-            "num_upcoming_shows": len(Show.query.filter_by(
-                artist_id=artist.id).filter(Show.start_time > datetime.now()).all())
-        })
+    limit = app.config['SEARCH_MAX_RESULTS']
+    real_search = search_results(search.search(Venue, search_term, limit) +
+                                 search.search(Artist, search_term, limit))
 
     return render_template('pages/search_venues.html', results=real_search,
                            search_term=request.form.get('search_term', ''))
 
 
 @app.route('/venues/<int:venue_id>')
+@query_budget(2)
+@cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
-    real_data = {}
-    venue = Venue.query.get(venue_id)
-    real_data["id"] = venue.id
-    real_data["name"] = venue.name
-    real_data["genres"] = venue.genres.strip("{").strip("}").split(",")
-    real_data["address"] = venue.address
-    real_data["city"] = venue.city
-    real_data["state"] = venue.state
-    real_data["phone"] = venue.phone
-    real_data["website"] = venue.website
-    real_data["facebook_link"] = venue.facebook_link
-    real_data["seeking_talent"] = venue.seeking_talent
-    real_data["image_link"] = venue.image_link
-    real_data["description"] = venue.description
-    real_data["past_shows"] = []
-    real_data["upcoming_shows"] = []
-    for show in venue.shows:
-        if show.start_time < datetime.now():
-            real_data["past_shows"].append({
-                "artist_id": show.artist_id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": show.start_time.strftime("%Y-%m-%d %H:%M:%S")
-            })
-        else:
-            real_data["upcoming_shows"].append({
-                "artist_id": show.artist_id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": show.start_time.strftime("%Y-%m-%d %H:%M:%S")
-            })
-    past_shows_count = len(real_data["past_shows"])
-    upcoming_shows_count = len(real_data["upcoming_shows"])
+    venue = Venue.query.options(queries.WITH_DETAILS).get_or_404(venue_id)
+    shows = queries.venue_shows(venue_id, datetime.now()).all()
 
-    return render_template('pages/show_venue.html', venue=real_data)
+    return render_template('pages/show_venue.html',
+                           venue=venue_details(venue, shows))
 
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
 @app.route('/venues/create', methods=['GET'])
+@query_budget(0)
 def create_venue_form():
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
 @app.route('/venues/create', methods=['POST'])
+@query_budget(2)
 def create_venue_submission():
     venueData = VenueForm(request.form).data
     error = False
@@ -190,6 +322,8 @@ def create_venue_submission():
             description=venueData["description"]
         )
         db.session.add(venue)
+        stale = ['venues']
+        bus.publish(*stale)
         db.session.commit()
     except:
         error = True
@@ -202,6 +336,7 @@ def create_venue_submission():
               request.form['name'] + ' could not be listed.')
         abort(500)
     else:
+        cache.invalidate(*stale)
         flash('Venue ' + request.form['name'] + ' was successfully listed!')
         return render_template('pages/home.html')
 
@@ -211,7 +346,9 @@ def delete_venue(venue_id):
     error = False
     try:
         venue = Venue.query.get(venue_id)
+        stale = venue_pages(venue_id)
         db.session.delete(venue)
+        bus.publish(*stale)
         db.session.commit()
     except:
         error = True
@@ -225,6 +362,7 @@ def delete_venue(venue_id):
               request.form['name'] + ' could not be deleted.')
         abort(500)
     else:
+        cache.invalidate(*stale)
         flash('Venue ' + request.form['name'] + ' was successfully deleted!')
         return render_template('pages/home.html')
 
@@ -236,87 +374,64 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@query_budget(1)
+@cache.cached('artists')
 def artists():
-    real_data = []
-    for artist in Artist.query.all():
-        real_data.append({
-            "id": artist.id,
-            "name": artist.name,
-        })
+    page = paginate(queries.artist_listing(), queries.ARTIST_KEYSET)
+
+    return stream_page('pages/artists.html', artists=page.items, page=page)
 
-    return render_template('pages/artists.html', artists=real_data)
+
+@app.route('/artists/genres/<genre>')
+@query_budget(1)
+@cache.cached('artists')
+def artists_by_genre(genre):
+    artists = queries.by_genre(queries.artist_listing(), Artist, genre,
+                               request.args.get('city'),
+                               request.args.get('state'))
+    page = paginate(artists, queries.ARTIST_KEYSET)
+
+    return stream_page('pages/artists.html', artists=page.items, page=page)
 
 
 @app.route('/artists/search', methods=['POST'])
+@query_budget(1)
+@read_only
 def search_artists():
-    real_response = {}
     search_term = request.form.get('search_term', '')
-    artists = Artist.query.filter(Artist.name.ilike(
-        '%' + search_term + '%')).all()
-    real_response['count'] = len(artists)
-    real_response['data'] = []
-    for artist in artists:
-        real_response['data'].append({
-            "id": artist.id,
-            "name": artist.name,
-            "num_upcoming_shows": len(Show.query.filter_by(
-                artist_id=artist.id).filter(Show.start_time > datetime.now()).all())
-        })
+    real_response = search_results(search.search(
+        Artist, search_term, app.config['SEARCH_MAX_RESULTS']))
 
     return render_template('pages/search_artists.html', results=real_response,
                            search_term=request.form.get('search_term', ''))
 
 
 @app.route('/artists/<int:artist_id>')
+@query_budget(2)
+@cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
     # shows the artist page with the given artist_id
-    real_data = {}
-    artist = Artist.query.get(artist_id)
-    real_data["id"] = artist.id
-    real_data["name"] = artist.name
-    real_data["genres"] = artist.genres.strip("{").strip("}").split(",")
-    real_data["city"] = artist.city
-    real_data["state"] = artist.state
-    real_data["phone"] = artist.phone
-    real_data["facebook_link"] = artist.facebook_link
-    real_data["image_link"] = artist.image_link
-    real_data["website"] = artist.website
-    real_data["seeking_venue"] = artist.seeking_venue
-    real_data["description"] = artist.description
-    real_data["upcoming_shows"] = []
-    real_data["past_shows"] = []
-    for show in artist.shows:
-        if show.start_time > datetime.now():
-            real_data["upcoming_shows"].append({
-                "venue_id": show.venue_id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-            })
-        else:
-            real_data["past_shows"].append({
-                "venue_id": show.venue_id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-            })
-    real_data["past_shows_count"] = len(real_data["past_shows"])
-    real_data["upcoming_shows_count"] = len(real_data["upcoming_shows"])
+    artist = Artist.query.options(queries.WITH_DETAILS).get_or_404(
+        artist_id)
+    shows = queries.artist_shows(artist_id, datetime.now()).all()
 
-    return render_template('pages/show_artist.html', artist=real_data)
+    return render_template('pages/show_artist.html',
+                           artist=artist_details(artist, shows))
 
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_artist(artist_id):
-    real_artist = Artist.query.get(artist_id)
+    real_artist = Artist.query.options(queries.WITH_DETAILS).get(artist_id)
     form = ArtistForm(obj=real_artist)
 
     return render_template('forms/edit_artist.html', form=form, artist=real_artist)
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@query_budget(4)
 def edit_artist_submission(artist_id):
     artistData = ArtistForm(request.form).data
     error = False
@@ -332,6 +447,8 @@ def edit_artist_submission(artist_id):
         artist.website = artistData["website"]
         artist.seeking_venue = artistData["seeking_venue"]
         artist.description = artistData["description"]
+        stale = artist_pages(artist_id)
+        bus.publish(*stale)
         db.session.commit()
     except:
         error = True
@@ -345,18 +462,21 @@ def edit_artist_submission(artist_id):
               request.form['name'] + ' could not be updated.')
         abort(500)
     else:
+        cache.invalidate(*stale)
         flash('Artist ' + request.form['name'] + ' was successfully updated!')
         return redirect(url_for('show_artist', artist_id=artist_id))
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_venue(venue_id):
-    real_venue = Venue.query.get(venue_id)
+    real_venue = Venue.query.options(queries.WITH_DETAILS).get(venue_id)
     form = VenueForm(obj=real_venue)
     return render_template('forms/edit_venue.html', form=form, venue=real_venue)
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@query_budget(4)
 def edit_venue_submission(venue_id):
     venueData = VenueForm(request.form).data
     error = False
@@ -371,6 +491,8 @@ def edit_venue_submission(venue_id):
         venue.website = venueData["website"]
         venue.seeking_talent = venueData["seeking_talent"]
         venue.description = venueData["description"]
+        stale = venue_pages(venue_id)
+        bus.publish(*stale)
         db.session.commit()
     except:
         error = True
@@ -384,6 +506,7 @@ def edit_venue_submission(venue_id):
               request.form['name'] + ' could not be updated.')
         abort(500)
     else:
+        cache.invalidate(*stale)
         flash('Venue ' + request.form['name'] + ' was successfully updated!')
         return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -392,12 +515,14 @@ def edit_venue_submission(venue_id):
 #  ----------------------------------------------------------------
 
 @app.route('/artists/create', methods=['GET'])
+@query_budget(0)
 def create_artist_form():
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
 @app.route('/artists/create', methods=['POST'])
+@query_budget(2)
 def create_artist_submission():
     artistData = ArtistForm(request.form).data
     error = False
@@ -415,6 +540,8 @@ def create_artist_submission():
             description=artistData["description"]
         )
         db.session.add(artist)
+        stale = ['artists']
+        bus.publish(*stale)
         db.session.commit()
     except:
         error = True
@@ -427,6 +554,7 @@ def create_artist_submission():
               data.name + ' could not be listed.')
         abort(500)
     else:
+        cache.invalidate(*stale)
         flash('Artist ' + request.form['name'] + ' was successfully listed!')
         return render_template('pages/home.html')
 
@@ -435,22 +563,15 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@query_budget(1)
+@cache.cached('shows')
 def shows():
-    shows = Show.query.all()
-    real_data = []
-    for show in shows:
-        real_data.append({
-            "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
-            "artist_id": show.artist_id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    return render_template('pages/shows.html', shows=real_data)
+    page = paginate(queries.show_listing(), queries.SHOW_KEYSET)
+    return stream_page('pages/shows.html', shows=page.items, page=page)
 
 
 @app.route('/shows/create')
+@query_budget(0)
 def create_shows():
     # renders form. do not touch.
     form = ShowForm()
@@ -458,6 +579,7 @@ def create_shows():
 
 
 @app.route('/shows/create', methods=['POST'])
+@query_budget(4)
 def create_show_submission():
     showData = ShowForm(request.form).data
     error = False
@@ -468,6 +590,11 @@ def create_show_submission():
             start_time=showData["start_time"]
         )
         db.session.add(show)
+        db.session.flush()
+        counters.shows_changed([show])
+        stale = ['shows', 'venues', 'venue:%s' % show.venue_id,
+                 'artist:%s' % show.artist_id]
+        bus.publish(*stale)
         db.session.commit()
     except:
         error = True
@@ -479,10 +606,16 @@ def create_show_submission():
         flash('An error occurred. Show could not be listed.')
         abort(500)
     else:
+        cache.invalidate(*stale)
         flash('Show was successfully listed!')
         return render_template('pages/home.html')
 
 
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(cache.stats(), bus=bus.stats()))
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -0,0 +1,292 @@
+"""ASGI entry point.
+
+The read routes - the venue, artist and show listings, the detail pages and
+the searches - are served here with SQLAlchemy's asyncio engine (asyncpg on
+Postgres, aiosqlite on SQLite), so a worker keeps serving other requests
+while one waits on the database. They reuse the statements of queries.py
+and search.py, the templates, the response cache and the replica routing of
+the Flask app. Every other route is handed to the Flask app unchanged,
+running in a thread.
+
+    uvicorn asgi:application --workers 4
+"""
+from datetime import datetime
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import abort, g, render_template, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+import queries
+import search
+from app import (app, artist_details, cache, search_results, stream_page,
+                 venue_areas, venue_details)
+from models import Artist, Venue
+from pagination import paginate_window
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+wsgi_application = WsgiToAsgi(app)
+
+# ----------------------------------------------------------------------------#
+# Engines.
+# ----------------------------------------------------------------------------#
+
+_engines = {}
+
+
+def async_engine_options(url):
+    """The engine options of config.py, with the psycopg2 connect arguments
+    translated for asyncpg."""
+    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if url.get_backend_name() != 'postgresql':
+        return url, options
+    server_settings = {'application_name': app.config['DB_APPLICATION_NAME']}
+    connect_args = {'server_settings': server_settings}
+    if app.config['DB_PGBOUNCER']:
+        # a PgBouncer server connection is shared between clients, so
+        # prepared statements cannot be cached on it
+        connect_args['statement_cache_size'] = 0
+        url = url.update_query_dict({'prepared_statement_cache_size': '0'})
+    else:
+        server_settings['statement_timeout'] = str(
+            app.config['DB_STATEMENT_TIMEOUT'])
+    options['connect_args'] = connect_args
+    return url, options
+
+
+def async_engine(bind=None):
+    """The asyncio engine of the primary, or of the replica `bind`."""
+    if bind not in _engines:
+        url = make_url(app.config['SQLALCHEMY_BINDS'][bind] if bind
+                       else app.config['SQLALCHEMY_DATABASE_URI'])
+        url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+        url, options = async_engine_options(url)
+        _engines[bind] = create_async_engine(url, **options)
+    return _engines[bind]
+
+
+async def dispose_engines():
+    while _engines:
+        await _engines.popitem()[1].dispose()
+
+
+async def fetch_all(session, query):
+    # run a Query built against the Flask-SQLAlchemy session on `session`
+    return (await session.execute(query.statement)).all()
+
+
+async def paginate(session, query, columns):
+    query, page_of = paginate_window(query, columns)
+    return page_of(await fetch_all(session, query))
+
+
+# ----------------------------------------------------------------------------#
+# Controllers.
+# ----------------------------------------------------------------------------#
+
+# Endpoint of the Flask route -> coroutine serving it. Each is called with an
+# AsyncSession and the view arguments of the route.
+ASYNC_VIEWS = {}
+
+
+def async_view(endpoint):
+    def decorator(view):
+        ASYNC_VIEWS[endpoint] = view
+        return view
+    return decorator
+
+
+@async_view('venues')
+@cache.cached('venues')
+async def venues(session):
+    page = await paginate(session, queries.venue_listing(),
+                          queries.VENUE_KEYSET)
+    return stream_page('pages/venues.html', areas=venue_areas(page.items),
+                       page=page)
+
+
+@async_view('venues_by_genre')
+@cache.cached('venues')
+async def venues_by_genre(session, genre):
+    locations = queries.by_genre(queries.venue_listing(), Venue, genre,
+                                 request.args.get('city'),
+                                 request.args.get('state'))
+    page = await paginate(session, locations, queries.VENUE_KEYSET)
+    return stream_page('pages/venues.html', areas=venue_areas(page.items),
+                       page=page)
+
+
+@async_view('search_venues')
+async def search_venues(session):
+    search_term = request.form.get('search_term', '')
+    limit = app.config['SEARCH_MAX_RESULTS']
+    rows = []
+    for model in (Venue, Artist):
+        rows += await fetch_all(session, search.search_query(
+            model, search_term, limit))
+    return render_template('pages/search_venues.html',
+                           results=search_results(rows),
+                           search_term=search_term)
+
+
+@async_view('show_venue')
+@cache.cached('venue:{venue_id}')
+async def show_venue(session, venue_id):
+    venue = await session.get(Venue, venue_id,
+                              options=[queries.WITH_DETAILS])
+    if venue is None:
+        abort(404)
+    shows = await fetch_all(session, queries.venue_shows(
+        venue_id, datetime.now()))
+    return render_template('pages/show_venue.html',
+                           venue=venue_details(venue, shows))
+
+
+@async_view('artists')
+@cache.cached('artists')
+async def artists(session):
+    page = await paginate(session, queries.artist_listing(),
+                          queries.ARTIST_KEYSET)
+    return stream_page('pages/artists.html', artists=page.items, page=page)
+
+
+@async_view('artists_by_genre')
+@cache.cached('artists')
+async def artists_by_genre(session, genre):
+    artists = queries.by_genre(queries.artist_listing(), Artist, genre,
+                               request.args.get('city'),
+                               request.args.get('state'))
+    page = await paginate(session, artists, queries.ARTIST_KEYSET)
+    return stream_page('pages/artists.html', artists=page.items, page=page)
+
+
+@async_view('search_artists')
+async def search_artists(session):
+    search_term = request.form.get('search_term', '')
+    rows = await fetch_all(session, search.search_query(
+        Artist, search_term, app.config['SEARCH_MAX_RESULTS']))
+    return render_template('pages/search_artists.html',
+                           results=search_results(rows),
+                           search_term=search_term)
+
+
+@async_view('show_artist')
+@cache.cached('artist:{artist_id}')
+async def show_artist(session, artist_id):
+    artist = await session.get(Artist, artist_id,
+                               options=[queries.WITH_DETAILS])
+    if artist is None:
+        abort(404)
+    shows = await fetch_all(session, queries.artist_shows(
+        artist_id, datetime.now()))
+    return render_template('pages/show_artist.html',
+                           artist=artist_details(artist, shows))
+
+
+@async_view('shows')
+@cache.cached('shows')
+async def shows(session):
+    page = await paginate(session, queries.show_listing(),
+                          queries.SHOW_KEYSET)
+    return stream_page('pages/shows.html', shows=page.items, page=page)
+
+
+# ----------------------------------------------------------------------------#
+# Application.
+# ----------------------------------------------------------------------------#
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def request_context(scope, body):
+    headers = [(name.decode('latin-1'), value.decode('latin-1'))
+               for name, value in scope['headers']]
+    client = scope.get('client') or ('', 0)
+    base_url = '%s://%s' % (scope.get('scheme', 'http'),
+                            dict(headers).get('host', 'localhost'))
+    return app.test_request_context(
+        scope['path'], base_url=base_url,
+        query_string=scope['query_string'], method=scope['method'],
+        headers=headers, data=body, environ_base={'REMOTE_ADDR': client[0]})
+
+
+async def dispatch(view, view_args):
+    # Flask's full_dispatch_request, awaiting the view
+    try:
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                async with AsyncSession(
+                        async_engine(g.get('replica_bind'))) as session:
+                    rv = await view(session, **view_args)
+        except Exception as error:
+            rv = app.handle_user_exception(error)
+        return app.finalize_request(rv)
+    except Exception as error:
+        return app.handle_exception(error)
+
+
+async def send_response(send, response):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    # streamed pages (see stream_page) go out chunk by chunk
+    try:
+        for chunk in response.iter_encoded():
+            await send({'type': 'http.response.body', 'body': chunk,
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        response.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await dispose_engines()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    view = view_args = None
+    if scope['type'] == 'http':
+        adapter = app.url_map.bind('localhost', scope.get('root_path', ''))
+        try:
+            endpoint, view_args = adapter.match(scope['path'],
+                                                method=scope['method'])
+            view = ASYNC_VIEWS.get(endpoint)
+        except HTTPException:
+            # 404s, 405s and redirects are left to Flask
+            pass
+    if view is None:
+        return await wsgi_application(scope, receive, send)
+
+    context = request_context(scope, await read_body(receive))
+    context.push()
+    try:
+        response = await dispatch(view, view_args)
+    finally:
+        context.pop()
+    await send_response(send, response)
@@ -0,0 +1,212 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+
+import click
+from flask import Blueprint, current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+from werkzeug.exceptions import NotFound
+from werkzeug.utils import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional, no .br files without it
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # optional, scripts are only concatenated without it
+    rjsmin = None
+
+# ----------------------------------------------------------------------------#
+# Static assets.
+# ----------------------------------------------------------------------------#
+
+# `flask assets build` concatenates and minifies the stylesheets and scripts
+# of layouts/main.html into bundles under static/dist, named after a hash of
+# their content, with .gz and .br copies next to them, and records the names
+# in static/dist/manifest.json. Templates ask for bundle_urls('main.css') or
+# asset_url('js/...'): the built file when there is one, the source files
+# otherwise, so nothing has to be built in development. Built files never
+# change under a name and are served with a year-long immutable
+# Cache-Control, precompressed when the client accepts it.
+#
+# Earlier builds are kept so pages cached before a deploy still find their
+# assets; `build --prune` removes them.
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+MAX_AGE = 365 * 24 * 3600
+
+# bundle -> source files under static/, in the order they are loaded
+BUNDLES = {
+    'main.css': ['css/bootstrap.min.css', 'css/layout.main.css',
+                 'css/main.css', 'css/main.responsive.css',
+                 'css/main.quickfix.css'],
+    'head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+    'main.js': ['js/script.js', 'js/libs/bootstrap-3.1.1.min.js',
+                'js/plugins.js'],
+}
+
+# loaded on their own, but fingerprinted all the same
+FILES = ['js/libs/jquery-1.11.1.min.js', 'js/libs/respond-1.4.2.min.js']
+
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s*([{};,>])\s*')
+SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+
+assets = Blueprint('assets', __name__)
+
+
+def rebase_urls(css, source, target):
+    # make the relative url()s of `source` relative to `target`, both paths
+    # of stylesheets under static/
+    def rebase(match):
+        url = match.group(2)
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        path = posixpath.normpath(posixpath.join(posixpath.dirname(source),
+                                                 path))
+        return 'url("%s%s")' % (
+            posixpath.relpath(path, posixpath.dirname(target)), suffix)
+    return CSS_URL.sub(rebase, css)
+
+
+def minify_css(css):
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(r'\1', ' '.join(css.split()))
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    js = SOURCE_MAP.sub('', js)
+    return rjsmin.jsmin(js) if rjsmin is not None else js
+
+
+def bundle(static_folder, name, sources):
+    parts = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+            content = f.read()
+        if name.endswith('.css'):
+            parts.append(minify_css(rebase_urls(
+                content, source, posixpath.join(DIST, name))))
+        else:
+            # a statement a library leaves open must not swallow the next
+            parts.append(minify_js(content).strip() + ';')
+    return '\n'.join(parts).encode()
+
+
+def _write(path, data):
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def write_asset(static_folder, name, data):
+    """Write `data` as static/dist/<stem>.<hash><ext> with its compressed
+    copies; return the path under static/."""
+    stem, extension = os.path.splitext(posixpath.basename(name))
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    path = posixpath.join(DIST, '%s.%s%s' % (stem, digest, extension))
+    target = os.path.join(static_folder, path)
+    _write(target, data)
+    # mtime=0: the same input always gives the same .gz
+    _write(target + '.gz', gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+        _write(target + '.br', brotli.compress(data))
+    return path
+
+
+_manifest = {}
+
+
+def manifest():
+    """{bundle or file: built path under static/}; empty until built."""
+    if not current_app.config['ASSETS_BUNDLE']:
+        return {}
+    path = os.path.join(current_app.static_folder, DIST, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    if _manifest.get('mtime') != mtime:
+        with open(path) as f:
+            _manifest.update(mtime=mtime, files=json.load(f))
+    return _manifest['files']
+
+
+@assets.app_template_global()
+def asset_url(filename):
+    """url_for('static', filename=...) of the built copy of `filename`."""
+    return url_for('static', filename=manifest().get(filename, filename))
+
+
+@assets.app_template_global()
+def bundle_urls(name):
+    """The URL of bundle `name`, or of its source files until it is built."""
+    built = manifest().get(name)
+    if built:
+        return [url_for('static', filename=built)]
+    return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+
+@assets.route('/static/%s/<path:filename>' % DIST)
+def dist(filename):
+    directory = os.path.join(current_app.static_folder, DIST)
+    if safe_join(directory, filename) is None:
+        raise NotFound()
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in PRECOMPRESSED:
+        if (request.accept_encodings[encoding] and
+                os.path.isfile(safe_join(directory, filename + suffix))):
+            response = send_from_directory(directory, filename + suffix,
+                                           mimetype=mimetype, max_age=MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename,
+                                       mimetype=mimetype, max_age=MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+assets_cli = AppGroup('assets', help='Build the static asset bundles.')
+
+
+@assets_cli.command('build')
+@click.option('--prune', is_flag=True,
+              help='Remove the files of earlier builds.')
+def build(prune):
+    """Bundle, minify, fingerprint and compress the static assets."""
+    static_folder = current_app.static_folder
+    os.makedirs(os.path.join(static_folder, DIST), exist_ok=True)
+    built = {}
+    for name, sources in BUNDLES.items():
+        built[name] = write_asset(static_folder, name,
+                                  bundle(static_folder, name, sources))
+        click.echo('%-10s -> %s' % (name, built[name]))
+    for filename in FILES:
+        with open(os.path.join(static_folder, filename), 'rb') as f:
+            built[filename] = write_asset(static_folder, filename, f.read())
+    _write(os.path.join(static_folder, DIST, MANIFEST),
+           json.dumps(built, indent=2, sort_keys=True).encode())
+
+    if prune:
+        keep = {MANIFEST} | {posixpath.basename(path) + suffix
+                             for path in built.values()
+                             for suffix in ('', '.gz', '.br')}
+        for name in os.listdir(os.path.join(static_folder, DIST)):
+            if name not in keep:
+                os.remove(os.path.join(static_folder, DIST, name))
@@ -0,0 +1,58 @@
+"""Per-row cost of the `datetime` template filter.
+
+Compares the old path (strftime in the view, dateutil + babel in the filter)
+with the filter fed datetime objects, with and without the memo.
+
+    python benchmarks/format_datetime.py [--rows 5000] [--distinct 500]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import click
+import dateutil.parser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def legacy(value, format='full'):
+    # the filter as it was: strftime'd string re-parsed, pattern re-parsed
+    date = dateutil.parser.parse(value.strftime('%Y-%m-%d %H:%M:%S'))
+    return babel.dates.format_datetime(
+        date, app.DATETIME_FORMATS[format], locale='en')
+
+
+def unmemoised(value, format='full'):
+    pattern, locale = app.datetime_pattern(format, 'en')
+    return pattern.apply(value, locale)
+
+
+@click.command()
+@click.option('--rows', default=5000, help='Timestamps formatted per run.')
+@click.option('--distinct', default=500,
+              help='Distinct timestamps among them.')
+@click.option('--repeat', default=5, help='Runs; the best one is reported.')
+def main(rows, distinct, repeat):
+    start = datetime(2026, 1, 1, 20)
+    values = [start + timedelta(hours=i % distinct) for i in range(rows)]
+    candidates = [
+        ('strftime + dateutil + babel', legacy),
+        ('datetime, precompiled pattern', unmemoised),
+        ('datetime, precompiled + memo', app.format_datetime),
+    ]
+    for value in values[:distinct]:
+        assert legacy(value) == app.format_datetime(value, 'full')
+
+    for name, function in candidates:
+        best = min(timeit.repeat(
+            lambda: [function(value, 'full') for value in values],
+            number=1, repeat=repeat))
+        click.echo('%-32s %8.2f us/row' % (name, best / rows * 1e6))
+
+
+if __name__ == '__main__':
+    main()
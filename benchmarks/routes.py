@@ -0,0 +1,209 @@
+"""Latency and query counts of every route of app.py.
+
+Each route is requested through the Flask test client against the database
+of DATABASE_URL (seed one with `flask seed`), with the response cache off.
+Results are written as JSON so runs on two commits can be compared:
+
+    DATABASE_URL=sqlite:////tmp/bench.db flask seed --reset
+    DATABASE_URL=sqlite:////tmp/bench.db \\
+        python benchmarks/routes.py --output before.json
+    ... change things ...
+    DATABASE_URL=sqlite:////tmp/bench.db \\
+        python benchmarks/routes.py --output after.json --baseline before.json
+
+Write routes create rows and rewrite a venue and an artist with their own
+values; pass --no-writes to leave the database untouched.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, cache  # noqa: E402
+from cache import NullCache  # noqa: E402
+from instrumentation import queries_reported  # noqa: E402
+from models import Artist, Show, Venue, db  # noqa: E402
+
+# (method, url, form data); {venue_id} and {artist_id} are filled in with
+# the venue and artist with the most upcoming shows
+READS = (
+    ('GET', '/', None),
+    ('GET', '/venues', None),
+    ('GET', '/venues?per_page=200', None),
+    ('GET', '/venues/{venue_id}', None),
+    ('GET', '/venues/genres/Jazz', None),
+    ('POST', '/venues/search', {'search_term': 'Hall'}),
+    ('GET', '/artists', None),
+    ('GET', '/artists/{artist_id}', None),
+    ('GET', '/artists/genres/Jazz', None),
+    ('POST', '/artists/search', {'search_term': 'Wolves'}),
+    ('GET', '/shows', None),
+    ('GET', '/venues/create', None),
+    ('GET', '/venues/{venue_id}/edit', None),
+    ('GET', '/artists/create', None),
+    ('GET', '/artists/{artist_id}/edit', None),
+    ('GET', '/shows/create', None),
+)
+
+VENUE_FORM = {
+    'name': 'Benchmark Hall', 'city': 'Austin', 'state': 'TX',
+    'address': '1 Main St', 'phone': '512-555-0100', 'genres': ['Jazz'],
+    'facebook_link': '', 'image_link': '', 'website': '',
+    'description': '',
+}
+ARTIST_FORM = {
+    'name': 'Benchmark Band', 'city': 'Austin', 'state': 'TX',
+    'phone': '512-555-0101', 'genres': ['Jazz'], 'facebook_link': '',
+    'image_link': '', 'website': '', 'description': '',
+}
+
+WRITES = (
+    ('POST', '/venues/create', VENUE_FORM),
+    ('POST', '/artists/create', ARTIST_FORM),
+    ('POST', '/shows/create', {'venue_id': '{venue_id}',
+                               'artist_id': '{artist_id}',
+                               'start_time': '2030-01-01 20:00:00'}),
+    ('POST', '/venues/{venue_id}/edit', 'venue'),
+    ('POST', '/artists/{artist_id}/edit', 'artist'),
+)
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def entity_form(entity):
+    # the edit form of `entity` filled with its current values
+    data = {column: getattr(entity, column) for column in (
+        'name', 'city', 'state', 'phone', 'genres', 'facebook_link',
+        'image_link', 'website', 'description')}
+    if isinstance(entity, Venue):
+        data['address'] = entity.address
+        seeking = 'seeking_talent'
+    else:
+        seeking = 'seeking_venue'
+    if getattr(entity, seeking):
+        data[seeking] = 'y'
+    return {key: value if value is not None else ''
+            for key, value in data.items()}
+
+
+def form_data(data, ids, entities):
+    if isinstance(data, str):
+        return entity_form(entities[data])
+    if data is None:
+        return None
+    return {key: value.format(**ids) if isinstance(value, str) else value
+            for key, value in data.items()}
+
+
+def measure(client, method, url, data, iterations):
+    timings, queries, status = [], 0, None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        # buffered, so streamed pages are timed until their last byte
+        response = client.open(url, method=method, data=data, buffered=True)
+        timings.append((time.perf_counter() - started) * 1000)
+        status = response.status_code
+        queries = queries_reported(response)
+    return {
+        'method': method,
+        'url': url,
+        'status': status,
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': queries,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    before = {(route['method'], route['url']): route
+              for route in baseline['routes']}
+    for route in results['routes']:
+        old = before.get((route['method'], route['url']))
+        if old is None:
+            continue
+        slower = route['p95_ms'] > old['p95_ms'] * (1 + tolerance)
+        more_queries = (route['queries'] or 0) > (old['queries'] or 0)
+        click.echo('%-4s %-32s p95 %8.2f -> %8.2f ms  queries %s -> %s%s' % (
+            route['method'], route['url'][:32], old['p95_ms'],
+            route['p95_ms'], old['queries'], route['queries'],
+            '  !!' if slower or more_queries else ''))
+
+
+@click.command()
+@click.option('--iterations', default=20, show_default=True,
+              help='Requests per route.')
+@click.option('--writes/--no-writes', default=True, show_default=True,
+              help='Include the create and edit handlers.')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Results of an earlier run to compare with.')
+@click.option('--tolerance', default=0.2, show_default=True,
+              help='p95 slowdown flagged against the baseline.')
+def main(iterations, writes, output, baseline, tolerance):
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SERVER_TIMING'] = True
+    app.debug = False
+    cache.backend = NullCache()
+    client = app.test_client()
+
+    with app.app_context():
+        venue = Venue.query.order_by(
+            Venue.upcoming_shows_count.desc(), Venue.id).first()
+        artist = Artist.query.order_by(
+            Artist.upcoming_shows_count.desc(), Artist.id).first()
+        if venue is None or artist is None:
+            raise click.ClickException('No data; run `flask seed` first.')
+        ids = {'venue_id': venue.id, 'artist_id': artist.id}
+        entities = {'venue': venue, 'artist': artist}
+        routes = READS + (WRITES if writes else ())
+        forms = [form_data(data, ids, entities) for _, _, data in routes]
+        results = {
+            'commit': git_commit(),
+            'database': db.engine.dialect.name,
+            'rows': {model.__tablename__: model.query.count()
+                     for model in (Venue, Artist, Show)},
+            'iterations': iterations,
+            'routes': [],
+        }
+        db.session.remove()
+
+    for (method, url, _), data in zip(routes, forms):
+        route = measure(client, method, url.format(**ids), data, iterations)
+        results['routes'].append(route)
+        click.echo('%-4s %-32s %3s  p50 %8.2f  p95 %8.2f ms  %s queries' % (
+            method, route['url'][:32], route['status'], route['p50_ms'],
+            route['p95_ms'], route['queries']))
+
+    # kilobytes on Linux, bytes on macOS
+    results['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    click.echo('peak RSS %d' % results['peak_rss'])
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            compare(results, json.load(f), tolerance)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import seed
+from cache import NullCache
+from instrumentation import budget_of, queries_reported
+from models import Artist, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Query budgets.
+# ----------------------------------------------------------------------------#
+
+# `flask budgets check` requests every budgeted route against scratch
+# databases of different sizes and fails when a route runs more statements
+# than its @query_budget at any of them - the same budget has to hold at 10
+# rows and at 10,000, which is what keeps N+1 loops out.
+#
+# Pages are not cached during the check (NullCache), but the write handlers
+# still publish to the invalidation bus, as they would with CACHE_TYPE =
+# 'lru', when the check runs against Postgres (--database); the NOTIFY is
+# one statement of their budgets.
+
+# (method, url, form data) per endpoint; {venue_id} and {artist_id} are
+# filled in with a venue and an artist that have shows
+ROUTES = {
+    'index': ('GET', '/', None),
+    'venues': ('GET', '/venues', None),
+    'venues_by_genre': ('GET', '/venues/genres/Jazz', None),
+    'search_venues': ('POST', '/venues/search', {'search_term': 'Hall'}),
+    'show_venue': ('GET', '/venues/{venue_id}', None),
+    'create_venue_form': ('GET', '/venues/create', None),
+    'create_venue_submission': ('POST', '/venues/create', {
+        'name': 'Budget Hall', 'city': 'Austin', 'state': 'TX',
+        'address': '1 Main St', 'phone': '512-555-0100',
+        'genres': ['Jazz', 'Blues'], 'facebook_link': '', 'image_link': '',
+        'website': '', 'description': ''}),
+    'edit_venue': ('GET', '/venues/{venue_id}/edit', None),
+    'edit_venue_submission': ('POST', '/venues/{venue_id}/edit', {
+        'name': 'Budget Hall', 'city': 'Austin', 'state': 'TX',
+        'address': '1 Main St', 'phone': '512-555-0100', 'genres': ['Jazz'],
+        'facebook_link': '', 'image_link': '', 'website': '',
+        'description': ''}),
+    'artists': ('GET', '/artists', None),
+    'artists_by_genre': ('GET', '/artists/genres/Jazz', None),
+    'search_artists': ('POST', '/artists/search', {'search_term': 'Band'}),
+    'show_artist': ('GET', '/artists/{artist_id}', None),
+    'create_artist_form': ('GET', '/artists/create', None),
+    'create_artist_submission': ('POST', '/artists/create', {
+        'name': 'Budget Band', 'city': 'Austin', 'state': 'TX',
+        'phone': '512-555-0101', 'genres': ['Jazz'], 'facebook_link': '',
+        'image_link': '', 'website': '', 'description': ''}),
+    'edit_artist': ('GET', '/artists/{artist_id}/edit', None),
+    'edit_artist_submission': ('POST', '/artists/{artist_id}/edit', {
+        'name': 'Budget Band', 'city': 'Austin', 'state': 'TX',
+        'phone': '512-555-0101', 'genres': ['Jazz'], 'facebook_link': '',
+        'image_link': '', 'website': '', 'description': ''}),
+    'shows': ('GET', '/shows', None),
+    'create_shows': ('GET', '/shows/create', None),
+    'create_show_submission': ('POST', '/shows/create', {
+        'venue_id': '{venue_id}', 'artist_id': '{artist_id}',
+        'start_time': '2030-01-01 20:00:00'}),
+}
+
+
+@contextmanager
+def scratch_database(app, url=None):
+    """Point the app at an empty database with the app's tables; a SQLite
+    file in a temporary directory unless `url` names another one, whose
+    tables are dropped afterwards."""
+    directory = None
+    if url is None:
+        directory = tempfile.mkdtemp(prefix='fyyur-budgets-')
+        url = 'sqlite:///' + os.path.join(directory, 'budgets.db')
+    saved = {key: app.config[key] for key in (
+        'SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_ENGINE_OPTIONS',
+        'SQLALCHEMY_BINDS', 'REPLICA_BINDS')}
+    app.config.update(SQLALCHEMY_DATABASE_URI=url,
+                      SQLALCHEMY_ENGINE_OPTIONS={}, SQLALCHEMY_BINDS={},
+                      REPLICA_BINDS=[])
+    try:
+        db.create_all()
+        yield
+    finally:
+        db.session.remove()
+        db.drop_all()
+        db.get_engine().dispose()
+        app.config.update(saved)
+        if directory:
+            shutil.rmtree(directory)
+
+
+def _format(value, ids):
+    if isinstance(value, str):
+        return value.format(**ids)
+    if isinstance(value, dict):
+        return {key: _format(item, ids) for key, item in value.items()}
+    return value
+
+
+def measure(app, size):
+    """{endpoint: statements} of every route with `size` venues and artists
+    and ten times as many shows."""
+    seed.populate(size, size, size * 10, batch_size=5000)
+    busiest = {
+        'venue_id': Venue.query.order_by(Venue.upcoming_shows_count.desc(),
+                                         Venue.id).first().id,
+        'artist_id': Artist.query.order_by(
+            Artist.upcoming_shows_count.desc(), Artist.id).first().id,
+    }
+    db.session.remove()
+    client = app.test_client()
+    counts = {}
+    # reads are requested once before being measured: the first request
+    # may warm per-process caches (search's FTS table lookup). Responses are
+    # buffered so streamed pages are generated, and closed, in the request
+    for endpoint, (method, url, data) in ROUTES.items():
+        if method == 'GET' or getattr(app.view_functions[endpoint],
+                                      'read_only', False):
+            client.open(_format(url, busiest), method=method,
+                        data=_format(data, busiest), buffered=True)
+    for endpoint, (method, url, data) in ROUTES.items():
+        response = client.open(_format(url, busiest), method=method,
+                               data=_format(data, busiest), buffered=True)
+        if response.status_code >= 400:
+            raise click.ClickException('%s %s answered %d' % (
+                method, url, response.status_code))
+        counts[endpoint] = queries_reported(response)
+    return counts
+
+
+budgets_cli = AppGroup('budgets', help='Check the per-route query budgets.')
+
+
+@budgets_cli.command('check')
+@click.option('--sizes', default='10,10000', show_default=True,
+              help='Venues and artists per run, comma separated; each run '
+                   'has ten times as many shows.')
+@click.option('--database',
+              help='Database to run against instead of a scratch SQLite '
+                   'file. Its tables are created and DROPPED.')
+def check(sizes, database):
+    """Fail when a route runs more statements than its @query_budget."""
+    app = current_app._get_current_object()
+    sizes = [int(size) for size in sizes.split(',')]
+    settings = {key: app.config.get(key, True) for key in (
+        'WTF_CSRF_ENABLED', 'SERVER_TIMING')}
+    app.config.update(WTF_CSRF_ENABLED=False, SERVER_TIMING=True)
+    cache = app.extensions['response_cache']
+    bus = app.extensions['invalidation_bus']
+    backend, cache.backend = cache.backend, NullCache()
+    enabled, bus.enabled = bus.enabled, True
+    try:
+        counts = {}
+        for size in sizes:
+            with scratch_database(app, database):
+                counts[size] = measure(app, size)
+    finally:
+        app.config.update(settings)
+        cache.backend = backend
+        bus.enabled = enabled
+
+    failures = 0
+    click.echo('%-26s %6s %s' % ('endpoint', 'budget', ' '.join(
+        '%8s' % size for size in sizes)))
+    for endpoint in ROUTES:
+        budget = budget_of(app.view_functions[endpoint])
+        over = budget is None or any(
+            counts[size][endpoint] > budget for size in sizes)
+        failures += over
+        click.echo('%-26s %6s %s%s' % (
+            endpoint, budget, ' '.join(
+                '%8d' % counts[size][endpoint] for size in sizes),
+            '  !!' if over else ''))
+    unchecked = [endpoint for endpoint, view in app.view_functions.items()
+                 if budget_of(view) is not None and endpoint not in ROUTES]
+    for endpoint in unchecked:
+        click.echo('%s has a budget but no route in budgets.ROUTES'
+                   % endpoint)
+    if failures or unchecked:
+        sys.exit(1)
+    click.echo('Every route is within its budget.')
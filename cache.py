@@ -0,0 +1,483 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import partial, wraps
+
+from flask import current_app, request, session
+from werkzeug.wrappers import Response
+
+from database import advisory_lock
+
+try:
+    import redis
+except ImportError:  # optional, only needed for CACHE_TYPE = 'redis'
+    redis = None
+
+# ----------------------------------------------------------------------------#
+# Backends.
+# ----------------------------------------------------------------------------#
+
+
+class BaseCache(object):
+    """Key/value store interface shared by every backend. Values are any
+    picklable object; `ttl` is in seconds, None meaning the backend default
+    and 0 meaning no expiry."""
+
+    def __init__(self, default_ttl=0):
+        self.default_ttl = default_ttl
+
+    def _expiry(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+
+class NullCache(BaseCache):
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(BaseCache):
+    """In-process cache evicting the least recently used entry beyond
+    `max_entries` and any entry older than its ttl."""
+
+    def __init__(self, max_entries=1024, default_ttl=0):
+        super(LRUCache, self).__init__(default_ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, self._expiry(ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileSystemCache(BaseCache):
+    """One pickle file per key under `cache_dir`, shareable by every worker
+    on a host."""
+
+    def __init__(self, cache_dir, default_ttl=0):
+        super(FileSystemCache, self).__init__(default_ttl)
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                value, expires = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires <= time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        # write to a temporary file first so readers never see partial data
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((value, self._expiry(ttl)), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(os.listdir(self.cache_dir))
+
+
+class RedisCache(BaseCache):
+    """Backend for any server speaking the Redis protocol."""
+
+    def __init__(self, url, default_ttl=0, key_prefix='fyyur:'):
+        super(RedisCache, self).__init__(default_ttl)
+        if redis is None:
+            raise RuntimeError("CACHE_TYPE 'redis' requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        value = self.client.get(self.key_prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self.client.set(self.key_prefix + key,
+                        pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                        ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.key_prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.key_prefix + '*'):
+            self.client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.key_prefix + '*'))
+
+
+# ----------------------------------------------------------------------------#
+# Response cache.
+# ----------------------------------------------------------------------------#
+
+
+class _Tee(object):
+    """Passes the chunks of a streamed body through, keeping a copy; calls
+    done(text) with the whole body once it has been iterated to the end, or
+    done(None) if it is closed before."""
+
+    def __init__(self, chunks, charset, done):
+        self._chunks = chunks
+        self._charset = charset
+        self._done = done
+        self._copy = []
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self._copy.append(chunk if isinstance(chunk, str)
+                              else chunk.decode(self._charset))
+            yield chunk
+        self._finish(''.join(self._copy))
+
+    def close(self):
+        self._finish(None)
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+
+    def _finish(self, text):
+        done, self._done = self._done, None
+        if done is not None:
+            done(text)
+
+
+
+class ResponseCache(object):
+    """Caches rendered pages of read routes.
+
+    Every entry belongs to a namespace such as 'venues' or 'venue:3'. Each
+    namespace has a version token stored in the backend next to the pages;
+    invalidating a namespace replaces its token, which orphans all of its
+    pages at once (every pagination cursor included) and lets the backend
+    evict them in its own time.
+
+    Concurrent misses on the same page are coalesced: one request renders
+    it while the others wait for its result (threads of a worker, or
+    coroutines of asgi.py), and with CACHE_SINGLE_FLIGHT_LOCK a Postgres
+    advisory lock extends this to every process sharing the backend."""
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.coalesced = 0
+        self.flight_fallbacks = 0
+        self.single_flight = True
+        self.flight_lock = False
+        self.flight_timeout = 10
+        self._flights = {}
+        self._async_flights = {}
+        self._flights_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['response_cache'] = self
+        cache_type = app.config.get('CACHE_TYPE', 'lru')
+        ttl = app.config.get('CACHE_DEFAULT_TTL', 0)
+        if cache_type == 'lru':
+            self.backend = LRUCache(app.config.get('CACHE_MAX_ENTRIES', 1024),
+                                    ttl)
+        elif cache_type == 'filesystem':
+            self.backend = FileSystemCache(app.config['CACHE_DIR'], ttl)
+        elif cache_type == 'redis':
+            self.backend = RedisCache(app.config['CACHE_REDIS_URL'], ttl)
+        elif cache_type == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError('Unknown CACHE_TYPE %r' % cache_type)
+        self.single_flight = app.config.get('CACHE_SINGLE_FLIGHT', True)
+        self.flight_lock = app.config.get('CACHE_SINGLE_FLIGHT_LOCK', False)
+        self.flight_timeout = app.config.get('CACHE_SINGLE_FLIGHT_TIMEOUT', 10)
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _version(self, namespace):
+        version = self.backend.get('version:' + namespace)
+        if version is None:
+            # one token per namespace, or concurrent misses right after an
+            # invalidation would key the same page differently and could
+            # not be coalesced
+            with self._flights_lock:
+                version = self.backend.get('version:' + namespace)
+                if version is None:
+                    version = uuid.uuid4().hex
+                    self.backend.set('version:' + namespace, version, ttl=0)
+        return version
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.delete('version:' + namespace)
+            self._count('invalidations')
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'coalesced': self.coalesced,
+            'flight_fallbacks': self.flight_fallbacks,
+        }
+
+    def _page_key(self, namespace, kwargs):
+        # None when the page must not be cached: pages rendered while flash
+        # messages are pending carry them
+        if request.method != 'GET' or session.get('_flashes'):
+            return None
+        scope = namespace.format(**kwargs)
+        return 'page:%s:%s:%s' % (scope, self._version(scope),
+                                  request.full_path)
+
+    def _lookup(self, key):
+        page = self.backend.get(key)
+        self._count('hits' if page is not None else 'misses')
+        return page
+
+    def _store(self, key, page):
+        if isinstance(page, str):
+            self.backend.set(key, page)
+
+    def _rendered(self, page, done):
+        # call done(text) once the page is complete - now, or for a streamed
+        # response once its body has been sent - or done(None) when it
+        # cannot be shared
+        if isinstance(page, Response) and page.is_streamed:
+            page.response = _Tee(page.response, page.charset, done)
+        else:
+            done(page if isinstance(page, str) else None)
+        return page
+
+    def _fill(self, key, render, done):
+        # render and store the page of `key`; under the advisory lock of the
+        # key when the backend is shared, so the processes that waited on
+        # the lock find the page instead of rendering it again
+        def store(page):
+            self._store(key, page)
+            done(page)
+
+        db = current_app.extensions['sqlalchemy'].db
+        if not (self.flight_lock and
+                isinstance(self.backend, (FileSystemCache, RedisCache)) and
+                db.engine.dialect.name == 'postgresql'):
+            return self._rendered(render(), store)
+        with advisory_lock(db.engine, key, self.flight_timeout) as acquired:
+            page = self.backend.get(key)
+            if page is not None:
+                self._count('coalesced')
+                done(page)
+                return page
+            if not acquired:
+                self._count('flight_fallbacks')
+            page = render()
+            if isinstance(page, Response) and page.is_streamed:
+                # generated while the lock is held, not streamed
+                page = page.get_data(as_text=True)
+            return self._rendered(page, store)
+
+    def _single_flight(self, key, render):
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                self._flights[key] = flight = [threading.Event(), None]
+                leader = True
+            else:
+                leader = False
+        if leader:
+            def land(page):
+                flight[1] = page
+                with self._flights_lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                flight[0].set()
+
+            try:
+                # a flight that landed between our lookup and now
+                page = self.backend.get(key)
+                if page is not None:
+                    self._count('coalesced')
+                    land(page)
+                    return page
+                return self._fill(key, render, land)
+            except BaseException:
+                if not flight[0].is_set():
+                    land(None)
+                raise
+        # only rendered text is shared; when the leader failed, returned a
+        # response object or took too long, render it here
+        if flight[0].wait(self.flight_timeout):
+            if isinstance(flight[1], str):
+                self._count('coalesced')
+                return flight[1]
+        else:
+            # a leader whose stream was never sent nor closed must not keep
+            # every later miss waiting
+            with self._flights_lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+        self._count('flight_fallbacks')
+        return render()
+
+    async def _single_flight_async(self, key, render):
+        flight = self._async_flights.get(key)
+        if flight is None:
+            # no await between the caller's lookup and here, so no other
+            # coroutine can have stored the page meanwhile
+            flight = self._async_flights[key] = asyncio.Future()
+
+            def land(page):
+                self._store(key, page)
+                if self._async_flights.get(key) is flight:
+                    del self._async_flights[key]
+                if not flight.done():
+                    flight.set_result(page)
+
+            try:
+                return self._rendered(await render(), land)
+            except BaseException:
+                land(None)
+                raise
+        try:
+            page = await asyncio.wait_for(asyncio.shield(flight),
+                                          self.flight_timeout)
+        except asyncio.TimeoutError:
+            if self._async_flights.get(key) is flight:
+                del self._async_flights[key]
+            page = None
+        if isinstance(page, str):
+            self._count('coalesced')
+            return page
+        self._count('flight_fallbacks')
+        return await render()
+
+    def cached(self, namespace):
+        """Decorate a GET view whose page belongs to `namespace`, formatted
+        with the view arguments (e.g. 'venue:{venue_id}'). Coroutine views
+        (see asgi.py) are supported; their positional arguments are passed
+        through untouched. A streamed page is stored once its body has been
+        sent in full."""
+        def decorator(view):
+            if inspect.iscoroutinefunction(view):
+                @wraps(view)
+                async def async_wrapper(*args, **kwargs):
+                    key = self._page_key(namespace, kwargs)
+                    page = key and self._lookup(key)
+                    if page is None:
+                        render = partial(view, *args, **kwargs)
+                        if key and self.single_flight:
+                            page = await self._single_flight_async(key,
+                                                                   render)
+                        else:
+                            page = await render()
+                            if key:
+                                self._rendered(page, partial(self._store,
+                                                             key))
+                    return page
+                return async_wrapper
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = self._page_key(namespace, kwargs)
+                page = key and self._lookup(key)
+                if page is None:
+                    render = partial(view, *args, **kwargs)
+                    if key and self.single_flight:
+                        page = self._single_flight(key, render)
+                    else:
+                        page = render()
+                        if key:
+                            self._rendered(page, partial(self._store, key))
+                return page
+            return wrapper
+        return decorator
@@ -0,0 +1,138 @@
+import zlib
+
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+# ----------------------------------------------------------------------------#
+# Response compression.
+# ----------------------------------------------------------------------------#
+
+# HTML, JSON and CSV responses are compressed with brotli or gzip, whichever
+# the client accepts (brotli first). Streamed pages are compressed chunk by
+# chunk and flushed as they go, so the client can render the head of the
+# page while the rest is still being generated. A strong ETag stays strong,
+# with the encoding appended, so each representation has its own validator.
+
+COMPRESSIBLE = ('text/html', 'text/css', 'text/csv', 'application/json',
+                'application/javascript')
+
+ENCODINGS = ('br', 'gzip')
+
+
+class Gzip(object):
+    encoding = 'gzip'
+
+    def __init__(self, level):
+        # wbits 16+: gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class Brotli(object):
+    encoding = 'br'
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def encoded_etag(etag, encoding):
+    """The ETag of the `encoding` representation of a response whose
+    uncompressed ETag is `etag`."""
+    return '%s-%s' % (etag, encoding)
+
+
+def negotiate(app):
+    """(compressor class, level) for the current request; (None, None)
+    when the client accepts neither encoding."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return Brotli, app.config['COMPRESS_BROTLI_LEVEL']
+    if accepted['gzip']:
+        return Gzip, app.config['COMPRESS_LEVEL']
+    return None, None
+
+
+def compress_stream(chunks, compressor, flush_size):
+    # compress the encoded chunks of a streamed body, flushing the first
+    # one (the head of the page, so the browser can fetch the stylesheets)
+    # and then every flush_size bytes of input
+    pending = flush_size
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_size:
+            data += compressor.flush()
+            pending = 0
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS', True)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_LEVEL', 5)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_FLUSH_SIZE', 8192)
+
+    def compress_response(response):
+        if (not app.config['COMPRESS'] or response.status_code != 200
+                or response.direct_passthrough
+                or response.mimetype not in COMPRESSIBLE
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not (response.is_streamed or len(response.get_data()) >=
+                app.config['COMPRESS_MIN_SIZE']):
+            return response
+        compressor_class, level = negotiate(app)
+        if compressor_class is None:
+            return response
+
+        compressor = compressor_class(level)
+        if response.is_streamed:
+            chunks = response.iter_encoded()
+            response.response = ClosingIterator(
+                compress_stream(chunks, compressor,
+                                app.config['COMPRESS_FLUSH_SIZE']),
+                [response.response.close]
+                if hasattr(response.response, 'close') else [])
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compressor.compress(response.get_data()) +
+                              compressor.finish())
+        response.headers['Content-Encoding'] = compressor.encoding
+        # the compressed body is a different representation of the same
+        # resource, and a strong validator names one representation
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(encoded_etag(etag, compressor.encoding))
+        return response
+
+    # Flask runs the app's after_request functions last registered first,
+    # after those of blueprints: at the head of the list this one runs after
+    # every other, whether registered before it (db.init_app's
+    # stick_to_primary) or after, and compresses what they produced
+    app.after_request_funcs.setdefault(None, []).insert(0, compress_response)
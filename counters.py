@@ -0,0 +1,202 @@
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_, select, update
+
+from invalidation import EVERYTHING
+from models import Artist, Show, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Show counters.
+# ----------------------------------------------------------------------------#
+
+# upcoming_shows_count, past_shows_count and next_show_at on venues and
+# artists are a cache of what the shows table says at a given moment. They
+# change when a show is added or removed, and when time passes the next show
+# of an entity, which is why next_show_at is kept: every row whose
+# next_show_at is in the past needs rolling forward.
+
+COUNTED = (
+    (Venue, Show.venue_id),
+    (Artist, Show.artist_id),
+)
+
+# rows past which the commands invalidate every cached page rather than
+# theirs; a NOTIFY payload is limited to 8000 bytes
+MAX_STALE_ROWS = 200
+
+
+def _computed(model, show_fk, now):
+    def shows(*criteria):
+        return select(*criteria).where(show_fk == model.id)
+
+    return {
+        'upcoming_shows_count': shows(db.func.count(Show.id)).where(
+            Show.start_time > now).scalar_subquery(),
+        'past_shows_count': shows(db.func.count(Show.id)).where(
+            Show.start_time <= now).scalar_subquery(),
+        'next_show_at': shows(db.func.min(Show.start_time)).where(
+            Show.start_time > now).scalar_subquery(),
+    }
+
+
+def _refresh(model, show_fk, where, now):
+    result = db.session.execute(
+        update(model).where(where).values(**_computed(model, show_fk, now))
+        .execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def refresh(venue_ids=(), artist_ids=(), now=None):
+    """Recompute the counters of the given venues and artists, in the
+    current transaction."""
+    now = now or datetime.now()
+    if venue_ids:
+        _refresh(Venue, Show.venue_id, Venue.id.in_(set(venue_ids)), now)
+    if artist_ids:
+        _refresh(Artist, Show.artist_id, Artist.id.in_(set(artist_ids)), now)
+
+
+def shows_changed(shows, now=None):
+    """Update the counters touched by adding or removing `shows`."""
+    refresh([show.venue_id for show in shows],
+            [show.artist_id for show in shows], now)
+
+
+def roll_forward(now=None):
+    """Move shows that have started since the last run from upcoming to
+    past. Only rows whose next show is due are touched; return {model: ids
+    of those rows}."""
+    now = now or datetime.now()
+    rolled = {}
+    for model, show_fk in COUNTED:
+        due = model.next_show_at <= now
+        rolled[model] = [id for (id,) in db.session.query(model.id).filter(
+            due)]
+        if rolled[model]:
+            _refresh(model, show_fk, due, now)
+    return rolled
+
+
+def rebuild(now=None):
+    now = now or datetime.now()
+    return sum(_refresh(model, show_fk, db.true(), now)
+               for model, show_fk in COUNTED)
+
+
+def stale_pages(venue_ids, artist_ids):
+    """Cache namespaces of the pages showing the counters of the given
+    venues and artists."""
+    if len(venue_ids) + len(artist_ids) > MAX_STALE_ROWS:
+        return [EVERYTHING]
+    namespaces = ['venue:%d' % id for id in venue_ids] + [
+        'artist:%d' % id for id in artist_ids]
+    if venue_ids:
+        namespaces.append('venues')
+    if artist_ids:
+        namespaces.append('artists')
+    return namespaces
+
+
+def staleness(now=None):
+    """{model name: {'due': rows still counting a show that has started as
+    upcoming, 'lag_seconds': how long the oldest of them has been due}}; both
+    stay near zero while `flask counters roll` runs on schedule."""
+    now = now or datetime.now()
+    report = {}
+    for model, _ in COUNTED:
+        due, oldest = db.session.query(
+            db.func.count(model.id), db.func.min(model.next_show_at)
+        ).filter(model.next_show_at <= now).one()
+        report[model.__name__] = {
+            'due': due,
+            'lag_seconds': round((now - oldest).total_seconds(), 1)
+            if oldest else 0.0,
+        }
+    return report
+
+
+def drift(now=None):
+    """Return {model name: [ids]} of rows whose stored counters disagree
+    with the shows table."""
+    now = now or datetime.now()
+    drifted = {}
+    for model, show_fk in COUNTED:
+        computed = _computed(model, show_fk, now)
+        mismatch = [
+            getattr(model, column) != value
+            for column, value in computed.items()
+            if column != 'next_show_at']
+        stored_next, computed_next = model.next_show_at, computed['next_show_at']
+        mismatch.append(or_(
+            stored_next != computed_next,
+            and_(stored_next.is_(None), computed_next.isnot(None)),
+            and_(stored_next.isnot(None), computed_next.is_(None))))
+        ids = db.session.query(model.id).filter(or_(*mismatch)).order_by(
+            model.id).all()
+        drifted[model.__name__] = [id for (id,) in ids]
+    return drifted
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+counters_cli = AppGroup('counters', help='Maintain the show counters.')
+
+
+def _commit(namespaces):
+    # as the write handlers do: published in the transaction, dropped from
+    # this process's cache once it commits
+    current_app.extensions['invalidation_bus'].publish(*namespaces)
+    db.session.commit()
+    cache = current_app.extensions['response_cache']
+    if EVERYTHING in namespaces:
+        cache.clear()
+    else:
+        cache.invalidate(*namespaces)
+
+
+@counters_cli.command('roll')
+def roll_command():
+    """Roll counters forward past shows that have started (run from cron)."""
+    rolled = roll_forward()
+    _commit(stale_pages(rolled[Venue], rolled[Artist]))
+    click.echo('Rolled forward %d rows.' % sum(map(len, rolled.values())))
+
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every counter from the shows table."""
+    rows = rebuild()
+    _commit([EVERYTHING])
+    click.echo('Rebuilt %d rows.' % rows)
+
+
+@counters_cli.command('status')
+@click.option('--max-lag', type=float,
+              help='Exit 1 when counters have been due for longer than this '
+                   'many seconds. Defaults to COUNTERS_MAX_LAG.')
+def status_command(max_lag):
+    """Report how far the counters lag behind the clock."""
+    if max_lag is None:
+        max_lag = current_app.config['COUNTERS_MAX_LAG']
+    report = staleness()
+    for name, lag in report.items():
+        click.echo('%s: %d due, oldest %.0fs' % (
+            name, lag['due'], lag['lag_seconds']))
+    if any(lag['lag_seconds'] > max_lag for lag in report.values()):
+        raise SystemExit(1)
+
+
+@counters_cli.command('check')
+def check_command():
+    """Report rows whose counters drifted from the shows table."""
+    drifted = drift()
+    for name, ids in drifted.items():
+        click.echo('%s: %d drifted%s' % (
+            name, len(ids), (' ' + str(ids[:20])) if ids else ''))
+    if any(drifted.values()):
+        raise SystemExit(1)
@@ -0,0 +1,133 @@
+import hashlib
+import random
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from instrumentation import ADVISORY_LOCK
+
+# ----------------------------------------------------------------------------#
+# Engine plumbing.
+# ----------------------------------------------------------------------------#
+
+
+@event.listens_for(Engine, 'begin')
+def set_local_statement_timeout(connection):
+    # Behind PgBouncer (see DB_PGBOUNCER in config.py) the statement timeout
+    # cannot be a startup option, so it is set at the start of every
+    # transaction and lapses with it. Goes through the DBAPI cursor: the
+    # Connection is still in the middle of beginning.
+    timeout = connection.get_execution_options().get(
+        'local_statement_timeout')
+    if timeout:
+        cursor = connection.connection.cursor()
+        cursor.execute('SET LOCAL statement_timeout = %d' % timeout)
+        cursor.close()
+
+
+@contextmanager
+def advisory_lock(engine, name, timeout):
+    """Hold the Postgres advisory lock of `name` across processes for the
+    duration of the block; yields False when it could not be taken within
+    `timeout` seconds. Its statements are reported as the `lock` metric of
+    the Server-Timing header (instrumentation.py)."""
+    key = int.from_bytes(hashlib.sha1(name.encode()).digest()[:8], 'big',
+                         signed=True)
+    engine = engine.execution_options(**ADVISORY_LOCK)
+    with engine.connect() as connection, connection.begin():
+        connection.execute(text('SET LOCAL lock_timeout = %d'
+                                % (timeout * 1000)))
+        try:
+            # in a savepoint: the timeout error aborts it, not the
+            # transaction holding the lock
+            with connection.begin_nested():
+                connection.execute(text('SELECT pg_advisory_xact_lock(:key)'),
+                                   {'key': key})
+            acquired = True
+        except OperationalError:
+            acquired = False
+        yield acquired
+
+
+# ----------------------------------------------------------------------------#
+# Read replicas.
+# ----------------------------------------------------------------------------#
+
+# Requests that only read (GET, HEAD and the views marked read_only) are
+# served by one of the REPLICA_BINDS, picked per request. Everything else -
+# flushes, DML, work outside a request - goes to the primary. A client that
+# has just written reads from the primary for REPLICA_STICKY_SECONDS so the
+# page it is redirected to shows its change despite replication lag.
+#
+# The stickiness is a cookie of its own that expires with the window, not a
+# session key: the session is signed with SECRET_KEY, which differs between
+# workers unless it is configured, and a forged cookie only sends its
+# client to the primary.
+
+READ_METHODS = ('GET', 'HEAD')
+PRIMARY_COOKIE = 'fyyur_primary'
+
+
+def read_only(view):
+    """Mark a view that reads but is not a GET (the search forms) as safe to
+    serve from a replica."""
+    view.read_only = True
+    return view
+
+
+def _is_read_request(app):
+    if request.method in READ_METHODS:
+        return True
+    view = app.view_functions.get(request.endpoint)
+    return getattr(view, 'read_only', False)
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self._db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = g.get('replica_bind') if has_request_context() else None
+        if replica is None or self._flushing or getattr(
+                clause, 'is_dml', False):
+            return SignallingSession.get_bind(self, mapper, clause)
+        return self._db.get_engine(self.app, bind=replica)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        app.config.setdefault('REPLICA_BINDS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 0)
+        SQLAlchemy.init_app(self, app)
+
+        @app.before_request
+        def choose_replica():
+            replicas = app.config['REPLICA_BINDS']
+            if (replicas and _is_read_request(app)
+                    and PRIMARY_COOKIE not in request.cookies):
+                g.replica_bind = random.choice(replicas)
+
+        @app.after_request
+        def stick_to_primary(response):
+            if app.config['REPLICA_BINDS'] and not _is_read_request(app):
+                response.set_cookie(
+                    PRIMARY_COOKIE, '1',
+                    max_age=app.config['REPLICA_STICKY_SECONDS'],
+                    httponly=True, samesite='Lax')
+            return response
+
+    def read_engine(self):
+        """The engine reads of the current request go to, for work done on
+        connections rather than through the session."""
+        replica = g.get('replica_bind') if has_request_context() else None
+        return self.get_engine(bind=replica)
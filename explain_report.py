@@ -0,0 +1,128 @@
+"""Report the query plan of every statement issued by the read routes.
+
+Each route is requested through the Flask test client against the
+configured database, the SQL it issues is captured, and every statement is
+re-run under EXPLAIN (EXPLAIN QUERY PLAN on SQLite). Run it against a
+database of realistic size: on a near-empty table Postgres rightly prefers a
+sequential scan, so pass --no-seqscan to check that an index *can* serve the
+query regardless of table size.
+
+    python explain_report.py [--no-seqscan] [--strict]
+"""
+import re
+import sys
+
+import click
+from sqlalchemy import event
+
+from app import app, cache
+from cache import NullCache
+from models import Artist, Venue, db
+
+TABLES = ('venues', 'artists', 'shows')
+
+# (method, url, form data); {venue_id} and {artist_id} are filled in with
+# rows from the database
+ROUTES = (
+    ('GET', '/venues', None),
+    ('GET', '/venues/{venue_id}', None),
+    ('GET', '/venues/genres/Jazz?city=San%20Francisco', None),
+    ('GET', '/artists', None),
+    ('GET', '/artists/{artist_id}', None),
+    ('GET', '/artists/genres/Jazz', None),
+    ('GET', '/shows', None),
+    ('POST', '/venues/search', {'search_term': 'Music'}),
+    ('POST', '/artists/search', {'search_term': 'Music'}),
+)
+
+PG_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def full_scans(dialect, plan):
+    pattern = PG_FULL_SCAN if dialect == 'postgresql' else SQLITE_FULL_SCAN
+    return [match.group(1) for line in plan
+            for match in [pattern.search(line.strip())]
+            if match and match.group(1) in TABLES]
+
+
+def explain(connection, dialect, statement, parameters):
+    if dialect == 'postgresql':
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+        return [row[0] for row in rows]
+    rows = connection.exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, parameters)
+    return [row[-1] for row in rows]
+
+
+def capture_route(client, method, url, data):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        # buffered: a streamed listing runs its template (and any lazy
+        # statement) before the listener is removed
+        response = client.open(url, method=method, data=data, buffered=True)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+    return response.status_code, statements
+
+
+@click.command()
+@click.option('--no-seqscan', is_flag=True,
+              help='Disable sequential scans while explaining (Postgres).')
+@click.option('--strict', is_flag=True,
+              help='Exit non-zero when any statement scans a whole table.')
+def report(no_seqscan, strict):
+    app.config['WTF_CSRF_ENABLED'] = False
+    cache.backend = NullCache()
+    client = app.test_client()
+    offenders = []
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        venue = db.session.query(Venue.id).order_by(Venue.id).first()
+        artist = db.session.query(Artist.id).order_by(Artist.id).first()
+        ids = {'venue_id': venue.id if venue else 1,
+               'artist_id': artist.id if artist else 1}
+
+        for method, url, data in ROUTES:
+            url = url.format(**ids)
+            status, statements = capture_route(client, method, url, data)
+            click.echo('=' * 78)
+            click.echo('%s %s -> %s, %d statements' % (
+                method, url, status, len(statements)))
+
+            with db.engine.connect() as connection:
+                if no_seqscan and dialect == 'postgresql':
+                    connection.exec_driver_sql('SET enable_seqscan = off')
+                for statement, parameters in statements:
+                    plan = explain(connection, dialect, statement, parameters)
+                    scanned = full_scans(dialect, plan)
+                    click.echo('-' * 78)
+                    click.echo(' '.join(statement.split()))
+                    for line in plan:
+                        click.echo('    ' + line)
+                    if scanned:
+                        click.echo('  !! full scan of %s' % ', '.join(scanned))
+                        offenders.append((method, url, scanned))
+
+    click.echo('=' * 78)
+    if offenders:
+        click.echo('%d statements scan whole tables:' % len(offenders))
+        for method, url, scanned in offenders:
+            click.echo('  %s %s: %s' % (method, url, ', '.join(scanned)))
+        if strict:
+            sys.exit(1)
+    else:
+        click.echo('Every statement is served by an index.')
+
+
+if __name__ == '__main__':
+    report()
@@ -0,0 +1,204 @@
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import click
+from flask import (Blueprint, Response, abort, current_app, request,
+                   stream_with_context)
+from flask.cli import AppGroup
+
+import importer
+from models import Artist, Show, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Exports.
+# ----------------------------------------------------------------------------#
+
+# Full-catalogue dumps for partners. Rows are read through a server-side
+# cursor (stream_results) a batch at a time and written to the response as
+# they arrive, so memory does not depend on the size of the table.
+#
+# ?since= returns the rows whose updated_at is later, for incremental pulls.
+# updated_at is the time a row was written, not the time its transaction
+# committed: a row written before a pull but committed after it has an
+# updated_at the pull's own rows may already be past, and a client starting
+# its next pull from the newest updated_at it received would never see it.
+# Every export therefore answers with the `since` its next pull should use,
+# in the X-Export-Next-Since header: its own start, less
+# EXPORT_SINCE_OVERLAP seconds. Rows written in that window are read again;
+# clients upsert by id, so that is harmless.
+
+export = Blueprint('export', __name__, url_prefix='/export')
+
+MODELS = {
+    'venues': Venue,
+    'artists': Artist,
+    'shows': Show,
+}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_value(value):
+    # genres as 'Jazz,Blues' and booleans as 'y' or '', as a form posts
+    # them, for `flask import` to read back
+    if isinstance(value, list):
+        return ','.join(value)
+    if isinstance(value, bool):
+        return 'y' if value else ''
+    return _json_value(value)
+
+
+def ndjson_lines(columns, rows):
+    return ''.join(
+        json.dumps({column: _json_value(value)
+                    for column, value in zip(columns, row)}) + '\n'
+        for row in rows)
+
+
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+    return buffer.getvalue()
+
+
+def stream_rows(statement, batch_size):
+    """Yield lists of up to `batch_size` rows of `statement`."""
+    with db.read_engine().connect() as connection:
+        result = connection.execution_options(
+            stream_results=True).execute(statement)
+        for partition in result.partitions(batch_size):
+            yield partition
+
+
+@export.route('/<entity>')
+def export_entity(entity):
+    model = MODELS.get(entity)
+    file_format = request.args.get('format', 'ndjson')
+    if model is None or file_format not in CONTENT_TYPES:
+        abort(404)
+
+    next_since = datetime.utcnow() - timedelta(
+        seconds=current_app.config['EXPORT_SINCE_OVERLAP'])
+    table = model.__table__
+    statement = db.select(table).order_by(table.c.updated_at, table.c.id)
+    since = request.args.get('since')
+    if since:
+        # rows created or changed after `since` (ISO 8601, UTC unless it
+        # has an offset); deletions are not reported
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            abort(400)
+        if since.tzinfo is not None:
+            # updated_at is naive UTC
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        statement = statement.where(table.c.updated_at > since)
+
+    columns = [column.name for column in table.columns]
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+
+    def generate():
+        if file_format == 'csv':
+            yield csv_lines(columns, [columns])
+        for rows in stream_rows(statement, batch_size):
+            if file_format == 'csv':
+                yield csv_lines(columns, rows)
+            else:
+                yield ndjson_lines(columns, rows)
+
+    response = Response(stream_with_context(generate()),
+                        content_type=CONTENT_TYPES[file_format])
+    response.headers['Content-Disposition'] = (
+        'attachment; filename=%s.%s' % (entity, file_format))
+    response.headers['X-Export-Next-Since'] = next_since.isoformat()
+    return response
+
+
+# ----------------------------------------------------------------------------#
+# Round trip.
+# ----------------------------------------------------------------------------#
+
+# `flask export check` reads every export back the way `flask import` does
+# and compares what the forms make of each row with the row it came from, so
+# a column written in a shape the importer misreads is caught before a
+# partner re-imports it. Start times are compared to the second, the
+# precision of ShowForm.
+
+export_cli = AppGroup('export', help='Check the catalogue exports.')
+
+
+def _comparable(value):
+    if value is None or value == '' or value is False:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0)
+    if isinstance(value, int) and not isinstance(value, bool):
+        # the show ids read back as strings
+        return str(value)
+    return value
+
+
+def round_trip(client, entity, file_format, batch_size):
+    """Yield (id, column, (in the database, read back)) of every value of
+    the export that does not read back as it is stored, and (id, None,
+    errors) of every row the importer rejects."""
+    model, form_class, columns = importer.ENTITIES[entity]
+    table = model.__table__
+    response = client.get('/export/%s?format=%s' % (entity, file_format),
+                          buffered=True)
+    records = importer.parse_rows(io.StringIO(
+        response.get_data(as_text=True), newline=''), file_format)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        rows = {row.id: row._mapping for row in db.session.execute(
+            db.select(table).where(table.c.id.in_(
+                [int(record['id']) for record in batch])))}
+        for record in batch:
+            id = int(record['id'])
+            values, errors = importer.validate(form_class, columns, record)
+            if errors:
+                yield id, None, errors
+                continue
+            for column in columns:
+                if _comparable(values[column]) != _comparable(
+                        rows[id][column]):
+                    yield id, column, (rows[id][column], values[column])
+        db.session.remove()
+
+
+@export_cli.command('check')
+@click.option('--batch-size', default=1000, show_default=True)
+def check(batch_size):
+    """Fail when an export does not read back as the rows it came from."""
+    client = current_app.test_client()
+    failures = 0
+    for entity in MODELS:
+        for file_format in CONTENT_TYPES:
+            found = 0
+            for id, column, difference in round_trip(
+                    client, entity, file_format, batch_size):
+                found += 1
+                if found <= 10:
+                    click.echo('  %s %d %s: %s' % (
+                        entity, id, column or 'rejected', difference))
+            click.echo('%-8s %-7s %s' % (
+                entity, file_format,
+                '%d differences' % found if found else 'reads back'))
+            failures += found
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import case, func
+
+import assets
+import queries
+from api import row_versions_etag
+from cache import NullCache
+from forms import GENRES
+from models import Artist, Show, Venue, db
+from pagination import keyset_paginate
+
+# ----------------------------------------------------------------------------#
+# Static snapshot.
+# ----------------------------------------------------------------------------#
+
+# `flask freeze` renders the public pages to FREEZE_DIR, one index.html per
+# URL (/venues/3 -> venues/3/index.html), for nginx or a CDN to serve
+# without reaching the app; listing pages past the first (?after=...) are
+# still served by the app:
+#
+#     location / { try_files $uri/index.html @app; }   # only when $args = ''
+#
+# Every page has a fingerprint of the rows it is rendered from - their
+# updated_at, show counts and past/upcoming split - and of the templates.
+# A run renders only the pages whose fingerprint differs from the manifest
+# of the previous run, and removes the pages of deleted rows.
+
+MANIFEST = '.manifest.json'
+
+
+def templates_version():
+    # the templates, and the asset bundles the pages link to
+    digest = hashlib.sha1()
+    folder = os.path.join(current_app.root_path, current_app.template_folder)
+    for directory, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+    digest.update(json.dumps(assets.manifest(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _first_page(query, keyset):
+    page = keyset_paginate(query, keyset, current_app.config['PAGE_SIZE'])
+    return [tuple(row) for row in page.items]
+
+
+def listing_pages():
+    yield '/', ()
+    yield '/venues', _first_page(queries.venue_listing(),
+                                 queries.VENUE_KEYSET)
+    yield '/artists', _first_page(queries.artist_listing(),
+                                  queries.ARTIST_KEYSET)
+    yield '/shows', _first_page(queries.show_listing(), queries.SHOW_KEYSET)
+    for genre in GENRES:
+        yield '/venues/genres/%s' % genre, _first_page(
+            queries.by_genre(queries.venue_listing(), Venue, genre),
+            queries.VENUE_KEYSET)
+        yield '/artists/genres/%s' % genre, _first_page(
+            queries.by_genre(queries.artist_listing(), Artist, genre),
+            queries.ARTIST_KEYSET)
+
+
+def detail_pages(model, show_fk, counterpart, counterpart_fk, prefix, now):
+    # one aggregate over the shows for every entity: the page changes when
+    # the entity, one of its shows or the venue/artist across a show does,
+    # and when a show moves from upcoming to past
+    rows = db.session.query(
+        model.id, model.updated_at,
+        func.count(Show.id), func.max(Show.updated_at),
+        func.max(counterpart.updated_at),
+        func.sum(case((Show.start_time > now, 1), else_=0))
+    ).outerjoin(Show, show_fk == model.id).outerjoin(
+        counterpart, counterpart.id == counterpart_fk
+    ).group_by(model.id, model.updated_at)
+    for row in rows:
+        yield '%s/%d' % (prefix, row[0]), tuple(row[1:])
+
+
+def public_pages(now):
+    """(url, versions) of every page to freeze."""
+    for page in listing_pages():
+        yield page
+    for page in detail_pages(Venue, Show.venue_id, Artist, Show.artist_id,
+                             '/venues', now):
+        yield page
+    for page in detail_pages(Artist, Show.artist_id, Venue, Show.venue_id,
+                             '/artists', now):
+        yield page
+
+
+def page_path(output, url):
+    return os.path.join(output, url.strip('/'), 'index.html')
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def remove_page(output, url):
+    path = page_path(output, url)
+    if os.path.exists(path):
+        os.remove(path)
+    directory = os.path.dirname(path)
+    while directory != output and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def load_manifest(output):
+    try:
+        with open(os.path.join(output, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@click.command('freeze')
+@click.option('--output', type=click.Path(file_okay=False),
+              help='Defaults to FREEZE_DIR.')
+@click.option('--full', is_flag=True, help='Render every page.')
+@with_appcontext
+def freeze_command(output, full):
+    """Render the public pages to static HTML, skipping unchanged ones."""
+    app = current_app._get_current_object()
+    output = os.path.abspath(output or app.config['FREEZE_DIR'])
+    started = time.time()
+    previous = {} if full else load_manifest(output)
+    templates = templates_version()
+    pages = {url: row_versions_etag(templates, versions)
+             for url, versions in public_pages(datetime.now())}
+    db.session.remove()
+
+    stale = [url for url, fingerprint in pages.items()
+             if previous.get(url) != fingerprint
+             or not os.path.exists(page_path(output, url))]
+    cache = app.extensions['response_cache']
+    debug, backend = app.debug, cache.backend
+    # no debug panel in the snapshot, and no cache entries left behind
+    app.debug, cache.backend = False, NullCache()
+    client = app.test_client()
+    try:
+        for url in stale:
+            response = client.get(quote(url), buffered=True)
+            if response.status_code != 200:
+                raise click.ClickException('%s answered %d' % (
+                    url, response.status_code))
+            write_atomic(page_path(output, url), response.get_data())
+    finally:
+        app.debug, cache.backend = debug, backend
+
+    removed = [url for url in previous if url not in pages]
+    for url in removed:
+        remove_page(output, url)
+    write_atomic(os.path.join(output, MANIFEST),
+                 json.dumps(pages, indent=0, sort_keys=True).encode())
+    click.echo('%d pages rendered, %d unchanged, %d removed in %.1fs' % (
+        len(stale), len(pages) - len(stale), len(removed),
+        time.time() - started))
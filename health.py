@@ -0,0 +1,67 @@
+import time
+
+from flask import Blueprint, current_app
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+
+import counters
+from api import json_response
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Health checks.
+# ----------------------------------------------------------------------------#
+
+health = Blueprint('health', __name__, url_prefix='/health')
+
+
+def pool_status(pool):
+    if not isinstance(pool, QueuePool):
+        # NullPool behind PgBouncer, SQLite's pools: nothing held here
+        return {'class': type(pool).__name__}
+    return {
+        'class': type(pool).__name__,
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
+
+
+def check(engine):
+    started = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            connection.execute(db.text('SELECT 1'))
+        status = 'ok'
+    except SQLAlchemyError:
+        status = 'unavailable'
+    return {
+        'status': status,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'pool': pool_status(engine.pool),
+    }
+
+
+@health.route('/db')
+def database():
+    """Round trip to the primary and each replica and the state of this
+    worker's pools; 503 when any of them cannot be reached."""
+    engines = {'primary': db.engine}
+    for bind in current_app.config['REPLICA_BINDS']:
+        engines[bind] = db.get_engine(bind=bind)
+    checks = {name: check(engine) for name, engine in engines.items()}
+    healthy = all(result['status'] == 'ok' for result in checks.values())
+    return json_response(dict(checks['primary'], replicas={
+        name: result for name, result in checks.items()
+        if name != 'primary'}), 200 if healthy else 503)
+
+
+@health.route('/counters')
+def counter_staleness():
+    """How long the show counters behind the listings have been due for a
+    `flask counters roll`; 503 past COUNTERS_MAX_LAG seconds."""
+    report = counters.staleness()
+    fresh = all(lag['lag_seconds'] <= current_app.config['COUNTERS_MAX_LAG']
+                for lag in report.values())
+    return json_response(report, 200 if fresh else 503)
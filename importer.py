@@ -0,0 +1,265 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.datastructures import MultiDict
+
+import counters
+from forms import ArtistForm, ShowForm, VenueForm
+from invalidation import EVERYTHING
+from models import Artist, Show, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Bulk import.
+# ----------------------------------------------------------------------------#
+
+# Rows are streamed from CSV or NDJSON files, validated with the same form
+# the HTML handlers use, and written a batch at a time with COPY on Postgres
+# or executemany elsewhere. Each batch is its own transaction.
+
+ENTITIES = {
+    'venues': (Venue, VenueForm, [
+        'name', 'city', 'state', 'address', 'phone', 'genres',
+        'facebook_link', 'image_link', 'website', 'seeking_talent',
+        'description']),
+    'artists': (Artist, ArtistForm, [
+        'name', 'city', 'state', 'phone', 'genres', 'facebook_link',
+        'image_link', 'website', 'seeking_venue', 'description']),
+    'shows': (Show, ShowForm, ['venue_id', 'artist_id', 'start_time']),
+}
+
+# what ShowForm.start_time parses
+FORM_DATETIME = '%Y-%m-%d %H:%M:%S'
+
+# the BooleanFields, and the strings read as false in them (BooleanField
+# itself only takes 'false' and '')
+BOOLEANS = ('seeking_talent', 'seeking_venue')
+FALSE_STRINGS = ('', 'false', 'f', 'no', 'n', 'off', '0')
+
+
+class Report(object):
+
+    def __init__(self):
+        self.read = 0
+        self.loaded = 0
+        self.rejected = []
+        self.started = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def summary(self):
+        return '%d read, %d loaded, %d rejected in %.1fs (%.0f rows/s)' % (
+            self.read, self.loaded, len(self.rejected), self.elapsed,
+            self.loaded / self.elapsed if self.elapsed else 0)
+
+
+def parse_rows(lines, file_format):
+    """Yield each record of CSV or NDJSON `lines` as a dict."""
+    if file_format == 'csv':
+        for row in csv.DictReader(lines):
+            yield row
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_rows(path, file_format=None):
+    """Yield each record of a CSV or NDJSON file as a dict."""
+    file_format = file_format or (
+        'ndjson' if os.path.splitext(path)[1] in ('.ndjson', '.jsonl')
+        else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in parse_rows(f, file_format):
+            yield row
+
+
+def _form_datetime(value):
+    # /export writes ISO 8601, '2030-01-01T20:00:00'; left as it is when it
+    # does not parse, for the form to reject
+    try:
+        return datetime.fromisoformat(value.strip()).strftime(FORM_DATETIME)
+    except ValueError:
+        return value
+
+
+def _formdata(record):
+    # genres may come as a JSON list, 'Jazz,Blues' or '{Jazz,Blues}'
+    data = MultiDict()
+    for key, value in record.items():
+        if key == 'genres' and isinstance(value, str):
+            value = [genre.strip().strip('"')
+                     for genre in value.strip('{}').split(',') if genre.strip()]
+        elif key == 'start_time' and isinstance(value, str):
+            value = _form_datetime(value)
+        elif key in BOOLEANS and isinstance(value, str):
+            value = value.strip().lower() not in FALSE_STRINGS
+        if isinstance(value, list):
+            for item in value:
+                data.add(key, item)
+        elif isinstance(value, bool):
+            if value:
+                data.add(key, 'y')
+        elif value is not None:
+            data.add(key, str(value))
+    return data
+
+
+def validate(form_class, columns, record):
+    """Return (values, None) for a valid record or (None, errors)."""
+    form = form_class(formdata=_formdata(record), meta={'csrf': False})
+    if not form.validate():
+        return None, form.errors
+    return {column: form.data[column] for column in columns}, None
+
+
+def _resolve(model, values):
+    # map ids and (case-insensitive) names to existing ids in one query each
+    ids = {value for value in values if str(value).isdigit()}
+    names = {value.lower() for value in values if not str(value).isdigit()}
+    resolved = {}
+    if ids:
+        for (id,) in db.session.query(model.id).filter(
+                model.id.in_([int(id) for id in ids])):
+            resolved[str(id)] = id
+    if names:
+        for id, name in db.session.query(model.id, db.func.lower(
+                model.name)).filter(db.func.lower(model.name).in_(names)):
+            resolved.setdefault(name, id)
+    return resolved
+
+
+def resolve_show_references(numbered_rows):
+    """Replace the venue/artist ids or names of (number, row) pairs by ids.
+    Return the resolved pairs and (number, row, errors) for the others."""
+    rows = [row for number, row in numbered_rows]
+    venues = _resolve(Venue, {str(row['venue_id']) for row in rows})
+    artists = _resolve(Artist, {str(row['artist_id']) for row in rows})
+    resolved, rejected = [], []
+    for number, row in numbered_rows:
+        venue_id = venues.get(str(row['venue_id']).lower())
+        artist_id = artists.get(str(row['artist_id']).lower())
+        if venue_id is None or artist_id is None:
+            errors = {}
+            if venue_id is None:
+                errors['venue_id'] = ['Unknown venue %r' % row['venue_id']]
+            if artist_id is None:
+                errors['artist_id'] = ['Unknown artist %r' % row['artist_id']]
+            rejected.append((number, row, errors))
+        else:
+            resolved.append(
+                (number, dict(row, venue_id=venue_id, artist_id=artist_id)))
+    return resolved, rejected
+
+
+def _copy_value(value):
+    if isinstance(value, list):
+        return '{%s}' % ','.join(
+            '"%s"' % item.replace('\\', '\\\\').replace('"', '\\"')
+            for item in value)
+    if value is None or value == '':
+        return None
+    return value
+
+
+def copy_rows(model, columns, rows):
+    """Load rows through the COPY protocol on the session's connection."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+        model.__tablename__, ', '.join(columns)), buffer)
+
+
+def insert_rows(model, columns, rows):
+    db.session.execute(model.__table__.insert(), rows)
+
+
+def write_rows(model, columns, rows):
+    """COPY on Postgres, executemany elsewhere; does not commit."""
+    if db.engine.dialect.name == 'postgresql':
+        copy_rows(model, columns, rows)
+    else:
+        insert_rows(model, columns, rows)
+
+
+def load_batch(model, columns, rows):
+    write_rows(model, columns, rows)
+    if model is Show:
+        counters.refresh([row['venue_id'] for row in rows],
+                         [row['artist_id'] for row in rows])
+    db.session.commit()
+
+
+def import_file(entity, path, file_format=None, batch_size=5000):
+    model, form_class, columns = ENTITIES[entity]
+    report = Report()
+    records = enumerate(read_rows(path, file_format), start=1)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        valid = []
+        for number, record in batch:
+            report.read += 1
+            values, errors = validate(form_class, columns, record)
+            if errors:
+                report.rejected.append((number, record, errors))
+            else:
+                valid.append((number, values))
+        if model is Show and valid:
+            valid, unresolved = resolve_show_references(valid)
+            report.rejected.extend(unresolved)
+        if valid:
+            load_batch(model, columns, [values for number, values in valid])
+            report.loaded += len(valid)
+        click.echo(report.summary(), err=True)
+    current_app.extensions['invalidation_bus'].publish(EVERYTHING)
+    db.session.commit()
+    current_app.extensions['response_cache'].clear()
+    return report
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+import_cli = AppGroup('import', help='Bulk load venues, artists and shows.')
+
+
+def _import_command(entity):
+    @import_cli.command(
+        entity, help='Import %s from a CSV or NDJSON file.' % entity)
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format', type=click.Choice(
+        ['csv', 'ndjson']), help='Defaults to the file extension.')
+    @click.option('--batch-size', default=5000, show_default=True)
+    @click.option('--rejects', type=click.Path(dir_okay=False),
+                  help='Write rejected rows and their errors as NDJSON.')
+    def command(path, file_format, batch_size, rejects):
+        report = import_file(entity, path, file_format, batch_size)
+        click.echo(report.summary())
+        if rejects and report.rejected:
+            with open(rejects, 'w', encoding='utf-8') as f:
+                for number, record, errors in report.rejected:
+                    f.write(json.dumps({'line': number, 'row': record,
+                                        'errors': errors}, default=str) + '\n')
+        for number, record, errors in report.rejected[:10]:
+            click.echo('  rejected record %d: %s' % (number, errors))
+    return command
+
+
+for _entity in ENTITIES:
+    _import_command(_entity)
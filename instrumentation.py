@@ -0,0 +1,176 @@
+import heapq
+import re
+import time
+from collections import Counter
+
+from flask import g, has_app_context, render_template, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# ----------------------------------------------------------------------------#
+# SQL instrumentation.
+# ----------------------------------------------------------------------------#
+
+# Every statement run while a request is being served is counted and timed
+# against that request, on every engine (primary, replicas, and the asyncio
+# engines of asgi.py, which run on sync engines underneath). Responses get
+# a Server-Timing header; a statement repeated more than
+# QUERY_REPEAT_THRESHOLD times in one request - the mark of an N+1 loop - is
+# logged as a warning; in debug mode HTML pages end with a panel of their
+# slowest statements. Views declare the most statements they may run with
+# @query_budget; going over it is logged, and `flask budgets check` fails.
+#
+# The advisory locks the response cache takes while a page is filled
+# (cache.py) run with the execution option ADVISORY_LOCK. They wait on other
+# processes rather than read data, so they get a Server-Timing metric of
+# their own, `lock`, and a line in the debug panel, instead of counting
+# against the budget of whichever view happened to fill the page.
+
+_whitespace = re.compile(r'\s+')
+# an expanded IN list, '(?, ?, ?)' or '(%(id_1_1)s, %(id_1_2)s)'
+_parameter = r'\s*(?:\?|%\(\w+\)s)\s*'
+_parameter_list = re.compile(r'\((?:%s,)*%s\)' % (_parameter, _parameter))
+
+
+ADVISORY_LOCK = {'advisory_lock': True}
+
+# the db entry of the Server-Timing header
+_server_timing_queries = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def query_budget(statements):
+    """Declare that a view runs at most `statements` SQL statements,
+    whatever the number of rows in the database."""
+    def decorator(view):
+        view.query_budget = statements
+        return view
+    return decorator
+
+
+def budget_of(view):
+    return getattr(view, 'query_budget', None)
+
+
+def queries_reported(response):
+    """The statement count of a response's Server-Timing header."""
+    match = _server_timing_queries.search(
+        ', '.join(response.headers.getlist('Server-Timing')))
+    return int(match.group(1)) if match else None
+
+
+def fingerprint(statement):
+    """`statement` with whitespace normalised and IN lists collapsed, so
+    the same query with different parameters has the same fingerprint."""
+    statement = _whitespace.sub(' ', statement).strip()
+    return _parameter_list.sub('(?)', statement)
+
+
+class QueryStats(object):
+    """The statements run while serving one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.timings = []
+        self.lock_count = 0
+        self.lock_duration = 0.0
+
+    def record(self, statement, duration):
+        statement = fingerprint(statement)
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[statement] += 1
+        self.timings.append((duration, statement))
+
+    def record_lock(self, statement, duration):
+        self.lock_count += 1
+        self.lock_duration += duration
+        self.timings.append((duration, fingerprint(statement)))
+
+    def repeated(self, threshold):
+        return [(statement, count)
+                for statement, count in self.fingerprints.most_common()
+                if count > threshold]
+
+    def slowest(self, number):
+        return heapq.nlargest(number, self.timings)
+
+
+def current_stats():
+    """The QueryStats of the request being served, or None."""
+    return g.get('query_stats') if has_app_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(connection, cursor, statement, parameters, context,
+                 executemany):
+    connection.info.setdefault('query_started', []).append(
+        time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(connection, cursor, statement, parameters, context,
+                executemany):
+    duration = time.perf_counter() - connection.info['query_started'].pop()
+    stats = current_stats()
+    if stats is None:
+        return
+    if context is not None and context.execution_options.get(
+            'advisory_lock'):
+        stats.record_lock(statement, duration)
+    else:
+        stats.record(statement, duration)
+
+
+def init_app(app):
+    app.config.setdefault('SERVER_TIMING', True)
+    app.config.setdefault('QUERY_REPEAT_THRESHOLD', 5)
+    app.config.setdefault('QUERY_PANEL_SIZE', 10)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = current_stats()
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+
+        threshold = app.config['QUERY_REPEAT_THRESHOLD']
+        for statement, count in stats.repeated(threshold):
+            app.logger.warning('%s %s ran the same statement %d times: %s',
+                               request.method, request.path, count, statement)
+
+        budget = budget_of(app.view_functions.get(request.endpoint))
+        if budget is not None and stats.count > budget:
+            app.logger.warning(
+                '%s %s ran %d statements, over its budget of %d',
+                request.method, request.path, stats.count, budget)
+
+        if app.config['SERVER_TIMING']:
+            response.headers.add(
+                'Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (
+                    stats.duration * 1000, stats.count))
+            if stats.lock_count:
+                response.headers.add(
+                    'Server-Timing', 'lock;dur=%.2f;desc="%d queries"' % (
+                        stats.lock_duration * 1000, stats.lock_count))
+            response.headers.add('Server-Timing',
+                                 'app;dur=%.2f' % (elapsed * 1000))
+
+        if (app.debug and response.mimetype == 'text/html'
+                and not response.is_streamed):
+            panel = render_template(
+                'debug/query_panel.html', stats=stats,
+                slowest=stats.slowest(app.config['QUERY_PANEL_SIZE']),
+                repeated=stats.repeated(threshold))
+            body = response.get_data(as_text=True)
+            if '</body>' in body:
+                body = body.replace('</body>', panel + '</body>', 1)
+                response.set_data(body)
+        return response
+
@@ -0,0 +1,137 @@
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from cache import LRUCache
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Invalidation bus.
+# ----------------------------------------------------------------------------#
+
+# With CACHE_TYPE = 'lru' every worker process holds its own copy of the
+# cached pages, and a write only invalidates the copy of the worker that
+# handled it. The write handlers therefore also publish the namespaces they
+# invalidate with NOTIFY, in the transaction of the write so the message
+# goes out if and only if the write commits; a thread in every worker
+# LISTENs and invalidates the same namespaces locally. Postgres only - on
+# other databases, and with a cache backend shared by the workers, there is
+# nothing to publish.
+
+CHANNEL = 'fyyur_cache'
+
+# namespace meaning every page, published when the data changed wholesale
+# (`flask import`, `flask seed`)
+EVERYTHING = '*'
+
+
+class InvalidationBus(object):
+
+    def __init__(self, app=None, cache=None):
+        self.cache = cache
+        self.enabled = False
+        self.origin = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.received = 0
+        self.connections = 0
+        self._listener = None
+        if app is not None:
+            self.init_app(app, cache)
+
+    def init_app(self, app, cache):
+        app.extensions['invalidation_bus'] = self
+        self.cache = cache
+        self.url = make_url(app.config.get('CACHE_BUS_URL') or
+                            app.config['SQLALCHEMY_DATABASE_URI'])
+        self.enabled = (app.config.get('CACHE_BUS', True)
+                        and self.url.get_backend_name() == 'postgresql'
+                        and isinstance(cache.backend, LRUCache))
+        if self.enabled:
+            # started by the first request of each worker: a thread started
+            # here would not survive the fork of a preloading server
+            app.before_request(self.start)
+
+    def publish(self, *namespaces, session=None):
+        """NOTIFY the other workers of `namespaces` within the transaction
+        of `session`; they receive it when the transaction commits."""
+        session = session or db.session
+        # the dialect is checked on every call: `flask budgets check` swaps
+        # the database
+        if not (self.enabled and namespaces
+                and session.get_bind().dialect.name == 'postgresql'):
+            return
+        payload = json.dumps({'origin': self.origin,
+                              'namespaces': list(namespaces)})
+        # one statement, counted in the query budget of every write handler
+        session.execute(
+            text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': CHANNEL, 'payload': payload})
+
+    def receive(self, payload):
+        message = json.loads(payload)
+        if message['origin'] == self.origin:
+            return
+        self.received += 1
+        if EVERYTHING in message['namespaces']:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(*message['namespaces'])
+
+    def start(self):
+        if self._listener is None or self._listener[0] != os.getpid():
+            thread = threading.Thread(target=self.listen,
+                                      args=(current_app.logger,),
+                                      name='invalidation-bus', daemon=True)
+            self._listener = (os.getpid(), thread)
+            self.origin = '%s:%d' % (socket.gethostname(), os.getpid())
+            thread.start()
+
+    def _connect(self):
+        import psycopg2
+
+        connection = psycopg2.connect(self.url.set(
+            drivername='postgresql').render_as_string(hide_password=False))
+        connection.autocommit = True
+        connection.cursor().execute('LISTEN ' + CHANNEL)
+        return connection
+
+    def listen(self, logger):
+        delay = 1
+        while True:
+            try:
+                connection = self._connect()
+            except Exception:
+                logger.exception('Invalidation bus cannot connect')
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+            if self.connections:
+                # messages sent while disconnected are lost
+                self.cache.clear()
+            self.connections += 1
+            delay = 1
+            try:
+                while True:
+                    select.select([connection], [], [], 60)
+                    connection.poll()
+                    while connection.notifies:
+                        self.receive(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Invalidation bus disconnected')
+            finally:
+                connection.close()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'listening': bool(self._listener
+                              and self._listener[1].is_alive()),
+            'received': self.received,
+            'reconnects': max(self.connections - 1, 0),
+        }
@@ -0,0 +1,35 @@
+"""artists.name not null
+
+Revision ID: 84e036f08856
+Revises: de08be8dc184
+Create Date: 2026-10-18 16:02:47.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '84e036f08856'
+down_revision = 'de08be8dc184'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the artist listing pages on (name, id) with a row-value comparison,
+    # which rows with a NULL name never satisfy
+    op.execute("UPDATE artists SET name = '' WHERE name IS NULL")
+    if op.get_bind().dialect.name == 'sqlite':
+        # SQLite cannot add the constraint without rebuilding the table,
+        # which would drop its FTS triggers; ArtistForm requires a name
+        return
+    op.alter_column('artists', 'name', existing_type=sa.String(),
+                    nullable=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    op.alter_column('artists', 'name', existing_type=sa.String(),
+                    nullable=True)
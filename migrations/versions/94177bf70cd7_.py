@@ -0,0 +1,55 @@
+"""show counters
+
+Revision ID: 94177bf70cd7
+Revises: d175fd29cc72
+Create Date: 2026-10-18 10:02:17.540921
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '94177bf70cd7'
+down_revision = 'd175fd29cc72'
+branch_labels = None
+depends_on = None
+
+COUNTED = (
+    ('venues', 'venue_id'),
+    ('artists', 'artist_id'),
+)
+
+
+def upgrade():
+    # the clock counters.py splits shows with: naive local time, which
+    # CURRENT_TIMESTAMP is not on a server outside UTC
+    now = datetime.now()
+    for table, show_fk in COUNTED:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_at', sa.DateTime(),
+                                       nullable=True))
+        op.create_index(op.f('ix_%s_next_show_at' % table), table,
+                        ['next_show_at'], unique=False)
+        op.execute(sa.text(
+            "UPDATE {t} SET "
+            "upcoming_shows_count = (SELECT count(*) FROM shows "
+            "WHERE shows.{fk} = {t}.id AND shows.start_time > :now), "
+            "past_shows_count = (SELECT count(*) FROM shows "
+            "WHERE shows.{fk} = {t}.id AND shows.start_time <= :now), "
+            "next_show_at = (SELECT min(start_time) FROM shows "
+            "WHERE shows.{fk} = {t}.id AND shows.start_time > :now)"
+            .format(t=table, fk=show_fk)).bindparams(now=now))
+
+
+def downgrade():
+    for table, show_fk in COUNTED:
+        op.drop_index(op.f('ix_%s_next_show_at' % table), table_name=table)
+        op.drop_column(table, 'next_show_at')
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -0,0 +1,114 @@
+"""genres as arrays
+
+Revision ID: 95bb3fc5cca6
+Revises: 94177bf70cd7
+Create Date: 2026-10-18 10:48:03.206114
+
+"""
+import csv
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '95bb3fc5cca6'
+down_revision = '94177bf70cd7'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venues', 'artists')
+
+# rows converted per statement, each batch committed on its own so the
+# backfill never holds locks on the whole table
+CHUNK_SIZE = 5000
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in TABLES:
+            backfill_sqlite(table, parse_array_literal)
+        return
+
+    for table in TABLES:
+        op.add_column(table, sa.Column(
+            'genres_list', postgresql.ARRAY(sa.String()), nullable=True))
+        backfill(
+            table, "genres_list = CASE WHEN genres LIKE '{%}' "
+                   "THEN genres::varchar[] ELSE ARRAY[genres]::varchar[] END")
+        op.drop_index('ix_%s_genres_trgm' % table, table_name=table)
+        op.drop_column(table, 'genres')
+        op.alter_column(table, 'genres_list', new_column_name='genres',
+                        nullable=False)
+        op.create_index('ix_%s_genres' % table, table, ['genres'],
+                        unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in TABLES:
+            backfill_sqlite(table, format_array_literal)
+        return
+
+    for table in TABLES:
+        op.add_column(table, sa.Column(
+            'genres_text', sa.String(length=120), nullable=True))
+        backfill(table, 'genres_text = genres::varchar')
+        op.drop_index('ix_%s_genres' % table, table_name=table)
+        op.drop_column(table, 'genres')
+        op.alter_column(table, 'genres_text', new_column_name='genres',
+                        nullable=False)
+        op.create_index('ix_%s_genres_trgm' % table, table, ['genres'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'genres': 'gin_trgm_ops'})
+
+
+def backfill(table, assignment):
+    bind = op.get_bind()
+    max_id = bind.execute(
+        sa.text('SELECT max(id) FROM %s' % table)).scalar() or 0
+    with op.get_context().autocommit_block():
+        for low in range(0, max_id, CHUNK_SIZE):
+            bind.execute(
+                sa.text('UPDATE %s SET %s WHERE id > :low AND id <= :high' %
+                        (table, assignment)),
+                {'low': low, 'high': low + CHUNK_SIZE})
+
+
+def backfill_sqlite(table, convert):
+    # SQLite has no array type; the column keeps its declared type and the
+    # values are rewritten in place
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text('SELECT id, genres FROM %s WHERE id > :last_id '
+                    'ORDER BY id LIMIT :limit' % table),
+            {'last_id': last_id, 'limit': CHUNK_SIZE}).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            sa.text('UPDATE %s SET genres = :genres WHERE id = :id' % table),
+            [{'id': id, 'genres': convert(genres)} for id, genres in rows])
+        last_id = rows[-1][0]
+
+
+def parse_array_literal(value):
+    # '{Jazz,"Musical Theatre"}' -> '["Jazz", "Musical Theatre"]'
+    if value is None or value.startswith('['):
+        return value
+    if not (value.startswith('{') and value.endswith('}')):
+        return json.dumps([value])
+    inner = value[1:-1]
+    items = next(csv.reader([inner], escapechar='\\')) if inner else []
+    return json.dumps(items)
+
+
+def format_array_literal(value):
+    if value is None or not value.startswith('['):
+        return value
+    return '{%s}' % ','.join(
+        '"%s"' % item.replace('"', '\\"') if ',' in item or ' ' in item
+        else item for item in json.loads(value))
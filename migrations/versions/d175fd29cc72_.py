@@ -0,0 +1,79 @@
+"""search indexes
+
+Revision ID: d175fd29cc72
+Revises: 3c8a49334214
+Create Date: 2026-10-18 09:12:40.118305
+
+"""
+import sqlite3
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd175fd29cc72'
+down_revision = '3c8a49334214'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = ('name', 'city', 'state', 'genres')
+TABLES = ('venues', 'artists')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        # the trigram tokenizer came with SQLite 3.34; searches use LIKE
+        # without it
+        if sqlite3.sqlite_version_info >= (3, 34, 0):
+            for table in TABLES:
+                create_sqlite_fts(table)
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in TABLES:
+        for column in SEARCH_COLUMNS:
+            op.create_index('ix_%s_%s_trgm' % (table, column), table,
+                            [column], unique=False,
+                            postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for table in TABLES:
+            for trigger in ('ai', 'ad', 'au'):
+                op.execute('DROP TRIGGER IF EXISTS %s_fts_%s' %
+                           (table, trigger))
+            op.execute('DROP TABLE IF EXISTS %s_fts' % table)
+        return
+
+    for table in TABLES:
+        for column in SEARCH_COLUMNS:
+            op.drop_index('ix_%s_%s_trgm' % (table, column), table_name=table)
+
+
+def create_sqlite_fts(table):
+    # External-content FTS5 table kept in sync with `table` by triggers.
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join('new.' + column for column in SEARCH_COLUMNS)
+    old_values = ', '.join('old.' + column for column in SEARCH_COLUMNS)
+    op.execute(
+        "CREATE VIRTUAL TABLE {t}_fts USING fts5({c}, content='{t}', "
+        "content_rowid='id', tokenize='trigram')".format(t=table, c=columns))
+    op.execute(
+        "CREATE TRIGGER {t}_fts_ai AFTER INSERT ON {t} BEGIN "
+        "INSERT INTO {t}_fts(rowid, {c}) VALUES (new.id, {n}); END".format(
+            t=table, c=columns, n=new_values))
+    op.execute(
+        "CREATE TRIGGER {t}_fts_ad AFTER DELETE ON {t} BEGIN "
+        "INSERT INTO {t}_fts({t}_fts, rowid, {c}) "
+        "VALUES ('delete', old.id, {o}); END".format(
+            t=table, c=columns, o=old_values))
+    op.execute(
+        "CREATE TRIGGER {t}_fts_au AFTER UPDATE ON {t} BEGIN "
+        "INSERT INTO {t}_fts({t}_fts, rowid, {c}) "
+        "VALUES ('delete', old.id, {o}); "
+        "INSERT INTO {t}_fts(rowid, {c}) VALUES (new.id, {n}); END".format(
+            t=table, c=columns, o=old_values, n=new_values))
+    op.execute("INSERT INTO {t}_fts({t}_fts) VALUES ('rebuild')".format(
+        t=table))
@@ -0,0 +1,36 @@
+"""updated_at timestamps
+
+Revision ID: de08be8dc184
+Revises: f1ac15b37ce8
+Create Date: 2026-10-18 12:14:36.902448
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'de08be8dc184'
+down_revision = 'f1ac15b37ce8'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venues', 'artists', 'shows')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        now = sa.text("(now() at time zone 'utc')")
+    else:
+        now = sa.text('CURRENT_TIMESTAMP')
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(),
+                                       server_default=now, nullable=False))
+        op.create_index(op.f('ix_%s_updated_at' % table), table,
+                        ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(op.f('ix_%s_updated_at' % table), table_name=table)
+        op.drop_column(table, 'updated_at')
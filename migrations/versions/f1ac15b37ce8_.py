@@ -0,0 +1,48 @@
+"""indexes for the hot queries
+
+Revision ID: f1ac15b37ce8
+Revises: 95bb3fc5cca6
+Create Date: 2026-10-18 11:30:51.663720
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1ac15b37ce8'
+down_revision = '95bb3fc5cca6'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns); built with CREATE INDEX CONCURRENTLY on Postgres
+# so the migration can run against a live database without blocking writes
+INDEXES = (
+    ('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time']),
+    ('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time']),
+    ('ix_shows_start_time_id', 'shows', ['start_time', 'id']),
+    ('ix_venues_state_city', 'venues', ['state', 'city', 'name', 'id']),
+    ('ix_artists_name_id', 'artists', ['name', 'id']),
+    ('ix_venues_lower_name', 'venues', [sa.text('lower(name)')]),
+    ('ix_artists_lower_name', 'artists', [sa.text('lower(name)')]),
+)
+
+
+def upgrade():
+    concurrently = (
+        'CONCURRENTLY ' if op.get_bind().dialect.name == 'postgresql' else '')
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            # a previously interrupted concurrent build leaves an INVALID
+            # index behind; drop it so the build can be retried
+            op.execute('DROP INDEX %sIF EXISTS %s' % (concurrently, name))
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True)
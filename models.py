@@ -1,26 +1,125 @@
-from flask_sqlalchemy import SQLAlchemy
+import sqlite3
+from datetime import datetime
 
-db = SQLAlchemy()
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from database import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
 
 
+# Native text[] on Postgres; SQLite, which has no arrays, stores a JSON list.
+GenreList = postgresql.ARRAY(db.String).with_variant(db.JSON, 'sqlite')
+
+
+class utcnow(FunctionElement):
+    # the current UTC time as a naive timestamp; Postgres' CURRENT_TIMESTAMP
+    # would be converted to the session's time zone
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "(now() at time zone 'utc')"
+
+
+def updated_at_column():
+    # UTC time of the last change to the row, e.g. for incremental exports;
+    # the server default is that of migration de08be8dc184
+    return db.Column(db.DateTime, nullable=False, index=True,
+                     default=datetime.utcnow, onupdate=datetime.utcnow,
+                     server_default=utcnow())
+
+
+def search_indexes(table, *columns):
+    # pg_trgm GIN indexes backing the ILIKE searches in search.py, plus the
+    # GIN index answering genre containment/overlap queries
+    return tuple(
+        db.Index('ix_%s_%s_trgm' % (table, column), column,
+                 postgresql_using='gin',
+                 postgresql_ops={column: 'gin_trgm_ops'})
+        for column in columns) + (
+        db.Index('ix_%s_genres' % table, 'genres', postgresql_using='gin'),)
+
+
+# FTS5's trigram tokenizer came with SQLite 3.34; searches use LIKE without
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def sqlite_fts(table, *columns):
+    # The FTS5 table search.py matches on SQLite: an external-content table
+    # over `columns`, kept in sync by triggers. The DDL of migration
+    # d175fd29cc72, for databases made by create_all.
+    if not FTS_TRIGRAM:
+        return
+    names = ', '.join(columns)
+    new = ', '.join('new.' + column for column in columns)
+    old = ', '.join('old.' + column for column in columns)
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {t}_fts USING fts5({c}, "
+        "content='{t}', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS {t}_fts_ai AFTER INSERT ON {t} BEGIN "
+        "INSERT INTO {t}_fts(rowid, {c}) VALUES ({n}); END",
+        "CREATE TRIGGER IF NOT EXISTS {t}_fts_ad AFTER DELETE ON {t} BEGIN "
+        "INSERT INTO {t}_fts({t}_fts, rowid, {c}) "
+        "VALUES ('delete', {o}); END",
+        "CREATE TRIGGER IF NOT EXISTS {t}_fts_au AFTER UPDATE ON {t} BEGIN "
+        "INSERT INTO {t}_fts({t}_fts, rowid, {c}) VALUES ('delete', {o}); "
+        "INSERT INTO {t}_fts(rowid, {c}) VALUES ({n}); END",
+    ]
+    for statement in statements:
+        event.listen(table, 'after_create', DDL(statement.format(
+            t=table.name, c=names, n='new.id, ' + new,
+            o='old.id, ' + old)).execute_if(dialect='sqlite'))
+    # the triggers go with the table
+    event.listen(table, 'before_drop', DDL(
+        'DROP TABLE IF EXISTS %s_fts' % table.name).execute_if(
+        dialect='sqlite'))
+
+
+# the operator class of the trigram indexes
+event.listen(db.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(
+    dialect='postgresql'))
+
+
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = search_indexes('venues', 'name', 'city', 'state') + (
+        db.Index('ix_venues_state_city', 'state', 'city', 'name', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.String(120), nullable=False)
+    genres = db.Column(GenreList, nullable=False)
     facebook_link = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
+    image_link = db.deferred(db.Column(db.String(500)), group='details')
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
-    description = db.Column(db.String(1500))
+    description = db.deferred(db.Column(db.String(1500)), group='details')
+    # maintained by counters.py
+    upcoming_shows_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime, index=True)
+    updated_at = updated_at_column()
     shows = db.relationship('Show', backref='venue', lazy=True)
 
 
@@ -34,26 +133,51 @@ artist_show = db.Table('artist_show',
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = search_indexes('artists', 'name', 'city', 'state') + (
+        db.Index('ix_artists_name_id', 'name', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, nullable=False)
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.String(120), nullable=False)
+    genres = db.Column(GenreList, nullable=False)
     facebook_link = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
+    image_link = db.deferred(db.Column(db.String(500)), group='details')
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
-    description = db.Column(db.String(1500))
+    description = db.deferred(db.Column(db.String(1500)), group='details')
+    # maintained by counters.py
+    upcoming_shows_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    next_show_at = db.Column(db.DateTime, index=True)
+    updated_at = updated_at_column()
     shows = db.relationship('Show', backref='artist', lazy=True)
 
 
 class Show(db.Model):
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey(
         'artists.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey(
         'venues.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    updated_at = updated_at_column()
     artists = db.relationship('Artist', secondary=artist_show, lazy=True)
+
+
+# case-insensitive exact name lookups
+db.Index('ix_venues_lower_name', db.func.lower(Venue.name))
+db.Index('ix_artists_lower_name', db.func.lower(Artist.name))
+
+
+sqlite_fts(Venue.__table__, 'name', 'city', 'state', 'genres')
+sqlite_fts(Artist.__table__, 'name', 'city', 'state', 'genres')
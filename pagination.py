@@ -0,0 +1,139 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, request
+from sqlalchemy import tuple_
+
+# ----------------------------------------------------------------------------#
+# Keyset pagination.
+# ----------------------------------------------------------------------------#
+
+# `items` are the rows of the page, `next_cursor` / `prev_cursor` are opaque
+# strings to pass back as `after` / `before`, or None at either end.
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor', 'per_page'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values],
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return object
+
+
+def decode_cursor(cursor, columns):
+    """The values of `cursor`, checked against the types of `columns` so a
+    forged cursor is a 400 rather than an error from the database."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(value) for value in values]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursor(cursor)
+    for value, column in zip(values, columns):
+        expected = _python_type(column)
+        # bool is an int to isinstance, and no keyset column is a boolean
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise InvalidCursor(cursor)
+        # NUL, which Postgres does not take in a string
+        if isinstance(value, str) and '\x00' in value:
+            raise InvalidCursor(cursor)
+    return values
+
+
+def keyset_window(query, columns, per_page, after=None, before=None):
+    """The query for one page of `query` ordered by `columns`, which must end
+    in a unique column so every row has a distinct position, and the
+    function turning the rows it returns into the Page.
+
+    Rows past `after` (or before `before`) are found with a row-value
+    comparison on `columns`, so an index on them serves every page in the
+    same time regardless of how deep it is."""
+    labels = ['_cursor_%d' % i for i in range(len(columns))]
+    query = query.add_columns(
+        *[column.label(label) for column, label in zip(columns, labels)])
+    key = tuple_(*columns)
+
+    def cursor_of(row):
+        return encode_cursor([getattr(row, label) for label in labels])
+
+    if before is not None:
+        values = decode_cursor(before, columns)
+
+        def backward_page(rows):
+            has_previous = len(rows) > per_page
+            rows = rows[:per_page][::-1]
+            return Page(rows,
+                        cursor_of(rows[-1]) if rows else None,
+                        cursor_of(rows[0]) if rows and has_previous else None,
+                        per_page)
+
+        return query.filter(key < tuple_(*values)).order_by(
+            *[column.desc() for column in columns]).limit(
+            per_page + 1), backward_page
+
+    if after is not None:
+        values = decode_cursor(after, columns)
+        query = query.filter(key > tuple_(*values))
+
+    def forward_page(rows):
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        return Page(rows,
+                    cursor_of(rows[-1]) if rows and has_next else None,
+                    cursor_of(rows[0]) if rows and after is not None else None,
+                    per_page)
+
+    return query.order_by(*columns).limit(per_page + 1), forward_page
+
+
+def keyset_paginate(query, columns, per_page, after=None, before=None):
+    """Return one Page of `query` ordered by `columns`; see keyset_window."""
+    query, page_of = keyset_window(query, columns, per_page, after, before)
+    return page_of(query.all())
+
+
+def paginate_window(query, columns):
+    """keyset_window of `query` driven by the request's after, before and
+    per_page arguments."""
+    per_page = request.args.get(
+        'per_page', current_app.config['PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+    try:
+        return keyset_window(query, columns, per_page,
+                             after=request.args.get('after'),
+                             before=request.args.get('before'))
+    except InvalidCursor:
+        abort(400)
+
+
+def paginate(query, columns):
+    """Keyset page of `query` driven by the request's after, before and
+    per_page arguments."""
+    query, page_of = paginate_window(query, columns)
+    return page_of(query.all())
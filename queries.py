@@ -0,0 +1,89 @@
+from sqlalchemy.orm import undefer_group
+
+import search
+from models import Artist, Show, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Read queries.
+# ----------------------------------------------------------------------------#
+
+# Queries behind the listing and detail pages, shared by the HTML views and
+# the JSON API. Listings are paginated on their *_KEYSET columns. Every row
+# carries the updated_at of each table it draws from, which the API uses as
+# row versions for its ETags.
+#
+# Listings select only the columns they show and hand the rows - compact
+# immutable tuples, outside the identity map - straight to the templates.
+# The long columns of Venue and Artist are deferred (the 'details' group);
+# pages that show them load an entity with WITH_DETAILS.
+
+WITH_DETAILS = undefer_group('details')
+
+VENUE_KEYSET = [Venue.state, Venue.city, Venue.name, Venue.id]
+ARTIST_KEYSET = [Artist.name, Artist.id]
+SHOW_KEYSET = [Show.start_time, Show.id]
+
+
+def venue_listing():
+    return db.session.query(
+        Venue.id, Venue.name, Venue.city, Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows'),
+        Venue.updated_at)
+
+
+def artist_listing():
+    return db.session.query(Artist.id, Artist.name, Artist.updated_at)
+
+
+def by_genre(query, model, genre, city=None, state=None):
+    # a listing narrowed to one genre and optionally a city and state
+    query = query.filter(search.genre_filter(model, [genre]))
+    if city:
+        query = query.filter(model.city == city)
+    if state:
+        query = query.filter(model.state == state)
+    return query
+
+
+def show_listing():
+    return db.session.query(
+        Show.id,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time,
+        Show.updated_at,
+        Venue.updated_at.label('venue_updated_at'),
+        Artist.updated_at.label('artist_updated_at')
+    ).join(Venue, Venue.id == Show.venue_id).join(
+        Artist, Artist.id == Show.artist_id)
+
+
+def venue_shows(venue_id, now):
+    # every show of the venue with its artist, flagged upcoming against `now`
+    return db.session.query(
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Show.start_time,
+        (Show.start_time > now).label('upcoming'),
+        Show.updated_at,
+        Artist.updated_at.label('artist_updated_at')
+    ).join(Artist, Artist.id == Show.artist_id).filter(
+        Show.venue_id == venue_id).order_by(Show.start_time)
+
+
+def artist_shows(artist_id, now):
+    # every show of the artist with its venue, flagged upcoming against `now`
+    return db.session.query(
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'),
+        Show.start_time,
+        (Show.start_time > now).label('upcoming'),
+        Show.updated_at,
+        Venue.updated_at.label('venue_updated_at')
+    ).join(Venue, Venue.id == Show.venue_id).filter(
+        Show.artist_id == artist_id).order_by(Show.start_time)
@@ -0,0 +1,173 @@
+import sqlite3
+import sys
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, exists, inspect, literal_column, or_, select
+
+from forms import GENRES
+from models import FTS_TRIGRAM, Artist, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Search.
+# ----------------------------------------------------------------------------#
+
+# Columns matched by a search term. On Postgres each of them carries a
+# pg_trgm GIN index, on SQLite they are mirrored into an FTS5 table. Genres
+# are matched separately against the GIN-indexed array.
+SEARCH_COLUMNS = ('name', 'city', 'state')
+
+FTS_TABLES = {
+    Venue: 'venues_fts',
+    Artist: 'artists_fts',
+}
+
+# FTS5's trigram tokenizer cannot match terms shorter than one trigram.
+FTS_MIN_TERM_LENGTH = 3
+
+# {database url: names of its tables}, for the FTS5 tables
+_tables = {}
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _has_fts_table(model):
+    # one lookup per database, made by init_app before the first request
+    if not FTS_TRIGRAM:
+        return False
+    engine = db.engine
+    if engine.url not in _tables:
+        _tables[engine.url] = set(inspect(engine).get_table_names())
+    return FTS_TABLES[model] in _tables[engine.url]
+
+
+@event.listens_for(db.metadata, 'after_create')
+@event.listens_for(db.metadata, 'after_drop')
+def _forget_tables(*args, **kwargs):
+    _tables.clear()
+
+
+def init_app(app):
+
+    @app.before_first_request
+    def find_fts_tables():
+        if db.engine.dialect.name == 'sqlite':
+            for model in FTS_TABLES:
+                _has_fts_table(model)
+
+
+def _search_query(model):
+    return db.session.query(model.id, model.name,
+                            model.upcoming_shows_count.label(
+                                'num_upcoming_shows'))
+
+
+def genre_filter(model, genres):
+    """Match rows of `model` listing any of `genres`."""
+    if db.engine.dialect.name == 'postgresql':
+        return model.genres.overlap(list(genres))
+    listed = db.func.json_each(model.genres).table_valued('value')
+    return exists(select(1).select_from(listed).where(
+        listed.c.value.in_(list(genres))))
+
+
+def matching_genres(term):
+    term = term.lower()
+    return [genre for genre in GENRES if term in genre.lower()]
+
+
+def _like_filter(model, term):
+    pattern = '%' + _escape_like(term) + '%'
+    criteria = [getattr(model, column).ilike(pattern, escape='\\')
+                for column in SEARCH_COLUMNS]
+    genres = matching_genres(term)
+    if genres:
+        criteria.append(genre_filter(model, genres))
+    return or_(*criteria)
+
+
+def search_query(model, search_term, limit=None):
+    """Query of (id, name, num_upcoming_shows) rows for `model` matching
+    `search_term`, best matches first."""
+    query = _search_query(model)
+    term = search_term.strip()
+    if not term:
+        return query.order_by(model.name, model.id).limit(limit)
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        # ILIKE on a column with a gin_trgm_ops index is answered from the
+        # index; similarity() ranks names closest to the term first.
+        rank = db.func.similarity(model.name, term)
+        query = query.filter(_like_filter(model, term)).order_by(
+            rank.desc(), model.name, model.id)
+    elif (dialect == 'sqlite' and len(term) >= FTS_MIN_TERM_LENGTH
+          and _has_fts_table(model)):
+        # `rank` is FTS5's hidden bm25() column, lower is better
+        fts = db.table(FTS_TABLES[model], db.column('rowid'),
+                       db.column('rank'))
+        phrase = '"' + term.replace('"', '""') + '"'
+        matches = db.session.query(
+            fts.c.rowid.label('id'), fts.c.rank.label('rank')
+        ).filter(literal_column(FTS_TABLES[model]).op('MATCH')(
+            phrase)).subquery()
+        query = query.join(matches, matches.c.id == model.id).order_by(
+            matches.c.rank, model.name, model.id)
+    else:
+        query = query.filter(_like_filter(model, term)).order_by(
+            model.name, model.id)
+
+    return query.limit(limit)
+
+
+def search(model, search_term, limit=None):
+    return search_query(model, search_term, limit).all()
+
+
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+search_cli = AppGroup('search', help='Check the search indexes.')
+
+
+@search_cli.command('check')
+@click.option('--sample', default=20, show_default=True,
+              help='Names searched for per table.')
+def check(sample):
+    """Fail when searching for a name does not find its row, or when SQLite
+    searches are not answered from the FTS5 tables."""
+    dialect = db.engine.dialect.name
+    fts = dialect == 'sqlite' and FTS_TRIGRAM
+    if dialect == 'sqlite' and not FTS_TRIGRAM:
+        click.echo('SQLite %s has no trigram tokenizer, searches use LIKE'
+                   % sqlite3.sqlite_version)
+    failures = 0
+    for model, fts_table in FTS_TABLES.items():
+        if fts and not _has_fts_table(model):
+            click.echo('%s: no %s table, searches fall back to LIKE' % (
+                model.__tablename__, fts_table))
+            failures += 1
+            continue
+        rows = db.session.query(model.id, model.name).filter(
+            db.func.length(model.name) >= FTS_MIN_TERM_LENGTH
+        ).order_by(model.id).limit(sample).all()
+        missed = []
+        for id, name in rows:
+            query = search_query(model, name)
+            if fts and fts_table not in str(query):
+                raise click.ClickException(
+                    'Searching %s for %r does not use %s' % (
+                        model.__tablename__, name, fts_table))
+            if id not in {row.id for row in query}:
+                missed.append((id, name))
+        for id, name in missed:
+            click.echo('  %s %d %r not found' % (model.__tablename__, id,
+                                                 name))
+        click.echo('%-8s %d of %d names found' % (
+            model.__tablename__, len(rows) - len(missed), len(rows)))
+        failures += len(missed)
+    if failures:
+        sys.exit(1)
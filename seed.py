@@ -0,0 +1,232 @@
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import counters
+from forms import GENRES
+from importer import write_rows
+from invalidation import EVERYTHING
+from models import Artist, Show, Venue, db
+
+# ----------------------------------------------------------------------------#
+# Synthetic data.
+# ----------------------------------------------------------------------------#
+
+# Datasets for benchmarks and query plans at realistic sizes. The same
+# --seed and --anchor always produce the same rows. Popularity is skewed the
+# way real listings are: a few cities hold most venues and artists, a few
+# genres most listings, and a few venues and artists most shows.
+
+CITIES = [
+    ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'),
+    ('San Francisco', 'CA'), ('Austin', 'TX'), ('Nashville', 'TN'),
+    ('Seattle', 'WA'), ('New Orleans', 'LA'), ('Atlanta', 'GA'),
+    ('Denver', 'CO'), ('Boston', 'MA'), ('Portland', 'OR'),
+    ('Philadelphia', 'PA'), ('Detroit', 'MI'), ('Miami', 'FL'),
+    ('Minneapolis', 'MN'), ('Memphis', 'TN'), ('Phoenix', 'AZ'),
+    ('Kansas City', 'MO'), ('Baltimore', 'MD'), ('Salt Lake City', 'UT'),
+    ('Columbus', 'OH'), ('Raleigh', 'NC'), ('Honolulu', 'HI'),
+]
+
+WORDS = [
+    'Blue', 'Red', 'Golden', 'Velvet', 'Electric', 'Crimson', 'Silver',
+    'Midnight', 'Neon', 'Wild', 'Hollow', 'Lucky', 'Broken', 'Iron',
+    'Paper', 'Echo', 'Black', 'Stone', 'Crystal', 'Rusty', 'Lonely',
+    'Howling', 'Burning', 'Northern',
+]
+VENUE_KINDS = ['Hall', 'Room', 'Club', 'Lounge', 'Theatre', 'Tavern',
+               'Garden', 'Ballroom', 'Bar', 'Stage']
+ARTIST_KINDS = ['Petals', 'Wolves', 'Sisters', 'Kings', 'Machine', 'Band',
+                'Collective', 'Trio', 'Orchestra', 'Revival']
+
+VENUE_COLUMNS = ['name', 'city', 'state', 'address', 'phone', 'genres',
+                 'facebook_link', 'image_link', 'website', 'seeking_talent',
+                 'description']
+ARTIST_COLUMNS = ['name', 'city', 'state', 'phone', 'genres',
+                  'facebook_link', 'image_link', 'website', 'seeking_venue',
+                  'description']
+SHOW_COLUMNS = ['venue_id', 'artist_id', 'start_time']
+
+
+def zipf_weights(count, exponent=1.1):
+    # cumulative weights for random.choices: item n is 1/n^s as popular
+    # as the first
+    return list(accumulate(1.0 / (rank ** exponent)
+                           for rank in range(1, count + 1)))
+
+
+class Generator(object):
+
+    def __init__(self, seed, anchor):
+        self.random = random.Random(seed)
+        self.anchor = anchor
+        self.city_weights = zipf_weights(len(CITIES))
+        self.genre_weights = zipf_weights(len(GENRES), 0.8)
+
+    def city(self):
+        return self.random.choices(CITIES, cum_weights=self.city_weights)[0]
+
+    def genres(self):
+        count = self.random.choice((1, 1, 2, 2, 3))
+        return sorted(set(self.random.choices(
+            GENRES, cum_weights=self.genre_weights, k=count)))
+
+    def phone(self):
+        return '%03d-%03d-%04d' % (self.random.randrange(200, 999),
+                                   self.random.randrange(100, 999),
+                                   self.random.randrange(10000))
+
+    def name(self, number, kinds):
+        # the number keeps names unique and searchable by prefix
+        return '%s %s %s %d' % (self.random.choice(WORDS),
+                                self.random.choice(WORDS),
+                                self.random.choice(kinds), number)
+
+    def description(self, name):
+        if self.random.random() < 0.3:
+            return None
+        return ('%s has been part of the scene since %d. ' % (
+            name, self.random.randrange(1960, 2024))) * self.random.randrange(
+            1, 6)
+
+    def venue(self, number):
+        city, state = self.city()
+        name = self.name(number, VENUE_KINDS)
+        slug = name.lower().replace(' ', '')
+        return {
+            'name': name,
+            'city': city,
+            'state': state,
+            'address': '%d %s St' % (self.random.randrange(1, 9999),
+                                     self.random.choice(WORDS)),
+            'phone': self.phone(),
+            'genres': self.genres(),
+            'facebook_link': 'https://www.facebook.com/%s' % slug,
+            'image_link': 'https://images.example.com/venues/%d.jpg' % number,
+            'website': 'https://www.%s.com' % slug,
+            'seeking_talent': self.random.random() < 0.4,
+            'description': self.description(name),
+        }
+
+    def artist(self, number):
+        city, state = self.city()
+        name = self.name(number, ARTIST_KINDS)
+        slug = name.lower().replace(' ', '')
+        return {
+            'name': name,
+            'city': city,
+            'state': state,
+            'phone': self.phone(),
+            'genres': self.genres(),
+            'facebook_link': 'https://www.facebook.com/%s' % slug,
+            'image_link': 'https://images.example.com/artists/%d.jpg' % number,
+            'website': 'https://www.%s.com' % slug,
+            'seeking_venue': self.random.random() < 0.4,
+            'description': self.description(name),
+        }
+
+    def shows(self, count, venue_ids, artist_ids):
+        # venues and artists are drawn in a shuffled order so the popular
+        # ones are spread over the id range
+        venue_ids, artist_ids = list(venue_ids), list(artist_ids)
+        self.random.shuffle(venue_ids)
+        self.random.shuffle(artist_ids)
+        venue_weights = zipf_weights(len(venue_ids), 0.9)
+        artist_weights = zipf_weights(len(artist_ids), 0.9)
+        for _ in range(count):
+            # two thirds in the past year, a third in the year ahead, on the
+            # hour in the evening
+            days = self.random.randrange(-365, 183)
+            hour = self.random.choice((18, 19, 20, 20, 21, 21, 22))
+            yield {
+                'venue_id': self.random.choices(
+                    venue_ids, cum_weights=venue_weights)[0],
+                'artist_id': self.random.choices(
+                    artist_ids, cum_weights=artist_weights)[0],
+                'start_time': self.anchor + timedelta(days=days, hours=hour),
+            }
+
+
+def today():
+    return datetime.combine(datetime.now().date(), datetime.min.time())
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _load(model, columns, rows, batch_size, label):
+    loaded = 0
+    for batch in _batches(rows, batch_size):
+        write_rows(model, columns, batch)
+        db.session.commit()
+        loaded += len(batch)
+        click.echo('%s: %d' % (label, loaded), err=True)
+    return loaded
+
+
+@click.command('seed')
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=2000, show_default=True)
+@click.option('--shows', default=50000, show_default=True)
+@click.option('--seed', default=1, show_default=True,
+              help='Random seed; the same seed gives the same data.')
+@click.option('--anchor', type=click.DateTime(['%Y-%m-%d']),
+              help='Date the shows are spread around (default: today). '
+                   'Pass it to reproduce a dataset on another day.')
+@click.option('--batch-size', default=10000, show_default=True)
+@click.option('--reset', is_flag=True,
+              help='Delete all shows, artists and venues first.')
+@with_appcontext
+def seed_command(venues, artists, shows, seed, anchor, batch_size, reset):
+    """Fill the database with generated venues, artists and shows."""
+    anchor = anchor or today()
+    venues, artists, shows = populate(venues, artists, shows, seed, anchor,
+                                      batch_size, reset)
+    click.echo('Seeded %d venues, %d artists and %d shows around %s '
+               '(seed %d).' % (venues, artists, shows, anchor.date(), seed))
+
+
+def populate(venues, artists, shows, seed=1, anchor=None, batch_size=10000,
+             reset=False):
+    """Generate the rows; return how many venues, artists and shows were
+    added."""
+    generator = Generator(seed, anchor or today())
+    if reset:
+        for model in (Show, Artist, Venue):
+            db.session.query(model).delete(synchronize_session=False)
+        db.session.commit()
+
+    first_venue = (db.session.query(db.func.max(Venue.id)).scalar() or 0) + 1
+    first_artist = (db.session.query(db.func.max(Artist.id)).scalar() or 0) + 1
+    _load(Venue, VENUE_COLUMNS,
+          (generator.venue(number) for number in range(1, venues + 1)),
+          batch_size, 'venues')
+    _load(Artist, ARTIST_COLUMNS,
+          (generator.artist(number) for number in range(1, artists + 1)),
+          batch_size, 'artists')
+    venue_ids = [id for (id,) in db.session.query(Venue.id).filter(
+        Venue.id >= first_venue).order_by(Venue.id)]
+    artist_ids = [id for (id,) in db.session.query(Artist.id).filter(
+        Artist.id >= first_artist).order_by(Artist.id)]
+    if not (venue_ids and artist_ids):
+        shows = 0
+    shows = _load(Show, SHOW_COLUMNS,
+                  generator.shows(shows, venue_ids, artist_ids),
+                  batch_size, 'shows')
+    counters.rebuild()
+    current_app.extensions['invalidation_bus'].publish(EVERYTHING)
+    db.session.commit()
+    current_app.extensions['response_cache'].clear()
+    return len(venue_ids), len(artist_ids), shows